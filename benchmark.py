@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+
+# Benchmarks for the lexer and the parsers.
+# Each benchmark builds a synthetic input, runs it a few times and reports
+# the best throughput. Run with --help for the options.
+# The suite benchmark measures every component (see suite_workloads) with
+# its peak memory; its results can be saved as a JSON baseline and later
+# runs compared against one, failing on a regression:
+#   python benchmark.py suite --save baseline.json
+#   python benchmark.py suite --baseline baseline.json --threshold 0.1
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import lexer
+import csv_parser
+import expr_bnf_parser
+import expr_ebnf_parser
+import expr_iterative_parser
+import expr_recalc
+import expr_optimize
+import expr_codegen
+
+# Building blocks of the synthetic expressions
+OPERANDS = ['x', 'y1', 'total', '7', '42', '1000']
+OPERATORS = ['+', '-', '*', '/', '^']
+
+# Nesting depth of the suite's nested expressions for the recursive parsers,
+# well within the default recursion limit
+NESTED_DEPTH = 100
+
+# Default fraction a suite result may be worse than its baseline by
+REGRESSION_THRESHOLD = 0.1
+
+# Peak memory differences below this many KiB are never regressions
+MEMORY_SLACK_KB = 64
+
+
+#an expression of about n operators, with some parenthesized groups
+def expr_corpus(n, seed=0, operators=OPERATORS):
+    rnd = random.Random(seed)
+    parts = [rnd.choice(OPERANDS)]
+    for i in range(n):
+        parts.append(' %s ' % rnd.choice(operators))
+        if rnd.random() < 0.1:
+            parts.append('(%s + %s)' % (rnd.choice(OPERANDS), rnd.choice(OPERANDS)))
+        else:
+            parts.append(rnd.choice(OPERANDS))
+    return ''.join(parts)
+
+
+#an expression of parentheses nested depth deep: ((x + 1) + 1) ...
+def nested_corpus(depth):
+    return '(' * depth + 'x' + ' + 1)' * depth
+
+
+#csv text of the given shape; quote_density is the fraction of quoted fields
+def csv_corpus(rows, cols, quote_density=0.1, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for r in range(rows):
+        fields = []
+        for c in range(cols):
+            if rnd.random() < quote_density:
+                fields.append('"v%d, w%d"' % (r, c))
+            else:
+                fields.append('v%d_%d' % (r, c))
+        lines.append(','.join(fields))
+    return '\n'.join(lines) + '\n'
+
+
+#best wall clock time of `repeat` calls of fn, and its last result
+def best_of(fn, repeat):
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+#a run of the lexer over text; returns the number of tokens
+def lexer_run(rules, text, **options):
+    lx = lexer.Lexer(rules, **options)
+
+    def run():
+        lx.input(text)
+        count = 0
+        for tok in lx.tokens():
+            count += 1
+        return count
+    return run
+
+
+#tokens per second of Lexer.token() over text
+def lexer_rate(rules, text, repeat=3, **options):
+    elapsed, count = best_of(lexer_run(rules, text, **options), repeat)
+    return count / elapsed
+
+
+#the first-character dispatch index against the plain combined regex
+def bench_dispatch(args):
+    corpora = [
+        ('expr', expr_ebnf_parser.RULES, expr_corpus(args.size)),
+        ('csv', csv_parser.RULES, csv_corpus(args.size // 10, 10)),
+    ]
+    print("%-6s %16s %16s %8s" % ("rules", "tokens/s before", "tokens/s after", "speedup"))
+    for name, rules, text in corpora:
+        before = lexer_rate(rules, text, args.repeat, dispatch=False)
+        after = lexer_rate(rules, text, args.repeat, dispatch=True)
+        print("%-6s %16.0f %16.0f %7.2fx" % (name, before, after, after / before))
+
+
+#a run of CsvParser.records() over text; returns the number of records
+def records_run(text, **options):
+    cp = csv_parser.CsvParser(trace=False)
+
+    def run():
+        count = 0
+        for record in cp.records(text, **options):
+            count += 1
+        return count
+    return run
+
+
+#records per second of CsvParser.records() over text
+def records_rate(text, repeat=3, **options):
+    elapsed, count = best_of(records_run(text, **options), repeat)
+    return count / elapsed
+
+
+#the quote-free fast path of CsvParser.records() against the productions,
+#on corpora with more and more quoted fields
+def bench_csv_fast(args):
+    rows = args.size // 10
+    print("%-8s %14s %14s %8s" % ("quoted", "rows/s before", "rows/s after", "speedup"))
+    for density in (0.0, 0.001, 0.01, 0.1):
+        text = csv_corpus(rows, 10, density)
+        before = records_rate(text, args.repeat, fast=False)
+        after = records_rate(text, args.repeat, fast=True)
+        print("%-8s %14.0f %14.0f %7.2fx" % ("%g%%" % (density * 100), before, after,
+                after / before))
+
+
+#bindings for the identifiers of OPERANDS, none of them zero
+def bindings_corpus(count, seed=0):
+    rnd = random.Random(seed)
+    return [{'x': rnd.randint(1, 9), 'y1': rnd.randint(1, 9), 'total': rnd.randint(1, 9)}
+            for i in range(count)]
+
+
+#evaluations per second of compiled statements over many bindings
+def eval_rate(expressions, bindings, repeat=3):
+    def run():
+        count = 0
+        for expression in expressions:
+            evaluate = expression.evaluate
+            for binding in bindings:
+                evaluate(binding)
+            count += len(bindings)
+        return count
+
+    elapsed, count = best_of(run, repeat)
+    return count / elapsed
+
+
+#tree walking against optimized trees and generated code, on formulas of
+#20 operators (no ^, whose random chains get huge)
+def bench_eval(args):
+    cp = expr_ebnf_parser.CalcParser(expr_ebnf_parser.RULES, trace=False)
+    trees = [cp.compile(expr_corpus(20, seed, '+-*/')) for seed in range(10)]
+    bindings = bindings_corpus(max(args.size // 100, 1))
+    backends = [
+        ('tree', trees),
+        ('optimized', [expr_optimize.optimize(e) for e in trees]),
+        ('codegen', [expr_codegen.generate(e) for e in trees]),
+        ('opt+codegen', [expr_codegen.generate(expr_optimize.optimize(e)) for e in trees]),
+    ]
+    base = None
+    print("%-12s %14s %8s" % ("backend", "evals/s", "speedup"))
+    for name, expressions in backends:
+        rate = eval_rate(expressions, bindings, args.repeat)
+        base = base or rate
+        print("%-12s %14.0f %7.2fx" % (name, rate, rate / base))
+
+
+#operators per second of compiling and evaluating text with a parser, None
+#if it runs out of stack
+def deep_rate(cp, text, operators, bindings, repeat=3):
+    def run():
+        return cp.compile(text).evaluate(bindings)
+
+    try:
+        elapsed, value = best_of(run, repeat)
+    except RecursionError:
+        return None
+    return operators / elapsed
+
+
+#the recursive EBNF parser against the iterative engine on a flat formula,
+#deeply nested parentheses and a long ^ chain, each of at least 10k
+#operators
+def bench_deep(args):
+    n = max(args.size // 10, 10000)
+    corpora = [
+        ('flat', expr_corpus(n, 0, '+-*/')),
+        ('nested', nested_corpus(n)),
+        ('power', ' ^ '.join(['1'] * (n + 1))),
+    ]
+    bindings = bindings_corpus(1)[0]
+    parsers = [
+        expr_ebnf_parser.CalcParser(expr_ebnf_parser.RULES, trace=False, cache_size=0),
+        expr_iterative_parser.CalcParser(expr_iterative_parser.RULES, trace=False, cache_size=0),
+    ]
+    print("%-8s %16s %16s %8s" % ("input", "ops/s recursive", "ops/s iterative", "speedup"))
+    for name, text in corpora:
+        before, after = [deep_rate(cp, text, n, bindings, args.repeat) for cp in parsers]
+        if before is None:
+            print("%-8s %16s %16.0f %8s" % (name, "RecursionError", after, "-"))
+        else:
+            print("%-8s %16.0f %16.0f %7.2fx" % (name, before, after, after / before))
+
+
+#updates per second of one input of a session of formulas, recomputing
+#what depends on it against evaluating every formula again
+def bench_recalc(args):
+    count = max(args.size // 10, 1)
+    inputs = 100
+    session = expr_recalc.RecalcSession()
+    session.update(dict(('x%d' % i, i) for i in range(inputs)))
+    # chains of formulas, each using an input and the one before it
+    for i in range(count):
+        used = 'f%d' % (i - inputs) if i >= inputs else '1'
+        session.execute('set f%d = x%d * 2 + %s' % (i, i % inputs, used))
+    order = session.affected(list(session.formulas))
+    # every run sets new values, so that something changes
+    runs = iter(range(1, 2 * args.repeat + 1))
+
+    def updates():
+        run = next(runs)
+        return [{'x%d' % i: run * 1000 + i} for i in range(inputs)]
+
+    def full():
+        for values in updates():
+            session.vars.update(values)
+            for name in order:
+                session.formulas[name].execute(session.vars)
+
+    def incremental():
+        for values in updates():
+            session.update(values)
+
+    before = inputs / best_of(full, args.repeat)[0]
+    after = inputs / best_of(incremental, args.repeat)[0]
+    print("%-10s %16s %16s %8s" % ("formulas", "updates/s full", "updates/s incr", "speedup"))
+    print("%-10d %16.1f %16.1f %7.2fx" % (count, before, after, after / before))
+
+
+#a run compiling and evaluating statements with a parser, repeated
+#times; returns the number of statements, or with units the number of
+#units (e.g. operators) per statement
+def calc_run(module, statements, bindings, times=1, units=1):
+    cp = module.CalcParser(module.RULES, trace=False, cache_size=0)
+
+    def run():
+        for i in range(times):
+            for text in statements:
+                cp.compile(text).evaluate(bindings)
+        return times * len(statements) * units
+    return run
+
+
+#the suite's workloads: (name, unit, run), run() doing the work once and
+#returning how many units it processed
+def suite_workloads(size):
+    rows = max(size // 10, 1)
+    flat = max(size // 10, 1000)
+    deep = max(size // 10, 1000)
+    statements = [expr_corpus(20, seed, '+-*/') for seed in range(100)]
+    bindings = bindings_corpus(1)[0]
+    expr_text = expr_corpus(size)
+    long_csv = csv_corpus(rows, 10, 0.05)
+    return [
+        ('lexer.expr', 'tokens/s', lexer_run(expr_ebnf_parser.RULES, expr_text)),
+        ('lexer.csv', 'tokens/s', lexer_run(csv_parser.RULES, long_csv)),
+        ('csv.long', 'rows/s', records_run(long_csv)),
+        ('csv.wide', 'rows/s', records_run(csv_corpus(max(size // 1000, 1), 1000, 0.05))),
+        ('csv.quoted', 'rows/s', records_run(csv_corpus(rows, 10, 0.5))),
+        ('calc.bnf.statements', 'evals/s', calc_run(expr_bnf_parser, statements, bindings)),
+        ('calc.ebnf.statements', 'evals/s', calc_run(expr_ebnf_parser, statements, bindings)),
+        ('calc.bnf.nested', 'levels/s', calc_run(expr_bnf_parser,
+                [nested_corpus(NESTED_DEPTH)], bindings, 20, NESTED_DEPTH)),
+        ('calc.ebnf.nested', 'levels/s', calc_run(expr_ebnf_parser,
+                [nested_corpus(NESTED_DEPTH)], bindings, 20, NESTED_DEPTH)),
+        ('calc.ebnf.flat', 'ops/s', calc_run(expr_ebnf_parser,
+                [expr_corpus(flat, 0, '+-')], bindings, units=flat)),
+        ('calc.iterative.nested', 'levels/s', calc_run(expr_iterative_parser,
+                [nested_corpus(deep)], bindings, units=deep)),
+    ]
+
+
+#peak memory (in KiB) allocated while running fn once
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024.0
+
+
+#run the suite; the results as saved in a baseline
+def run_suite(size, repeat):
+    metrics = {}
+    for name, unit, run in suite_workloads(size):
+        elapsed, count = best_of(run, repeat)
+        # timed without tracemalloc, which slows everything down
+        metrics[name] = {
+            'value': round(count / elapsed, 1),
+            'unit': unit,
+            'peak_kb': round(peak_memory(run), 1),
+        }
+    return {
+        'size': size,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'metrics': metrics,
+    }
+
+
+#the suite's results against a baseline: a row (name, value, baseline
+#value, change, status) per metric; results are throughputs, so a
+#regression is a value below the baseline (or a peak memory above it) by
+#more than threshold
+def compare_suite(results, baseline, threshold):
+    rows = []
+    for name, metric in sorted(results['metrics'].items()):
+        base = baseline['metrics'].get(name)
+        if base is None:
+            rows.append((name, metric['value'], None, None, 'new'))
+            continue
+        change = metric['value'] / base['value'] - 1 if base['value'] else 0.0
+        status = 'ok'
+        if change < -threshold:
+            status = 'REGRESSION'
+        elif (metric['peak_kb'] > base['peak_kb'] * (1 + threshold) and
+                metric['peak_kb'] - base['peak_kb'] > MEMORY_SLACK_KB):
+            status = 'MEMORY'
+        rows.append((name, metric['value'], base['value'], change, status))
+    return rows
+
+
+#every component with its peak memory, optionally saved as or compared
+#against a JSON baseline; returns the number of regressions
+def bench_suite(args):
+    results = run_suite(args.size, args.repeat)
+    print("%-24s %14s %-10s %10s" % ("metric", "value", "unit", "peak KiB"))
+    for name, metric in sorted(results['metrics'].items()):
+        print("%-24s %14.1f %-10s %10.1f" % (name, metric['value'], metric['unit'],
+                metric['peak_kb']))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("saved %s" % args.save)
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('size') != results['size']:
+        print("warning: baseline was run with --size %s" % baseline.get('size'),
+                file=sys.stderr)
+    rows = compare_suite(results, baseline, args.threshold)
+    print()
+    print("%-24s %14s %14s %8s  %s" % ("metric", "value", "baseline", "change", "status"))
+    for name, value, base, change, status in rows:
+        if base is None:
+            print("%-24s %14.1f %14s %8s  %s" % (name, value, "-", "-", status))
+        else:
+            print("%-24s %14.1f %14.1f %+7.1f%%  %s" % (name, value, base, change * 100,
+                    status))
+    failed = [row for row in rows if row[4] in ('REGRESSION', 'MEMORY')]
+    print("%d of %d metrics regressed (threshold %g%%)" % (len(failed), len(rows),
+            args.threshold * 100))
+    return len(failed)
+
+
+BENCHMARKS = {
+    'dispatch': bench_dispatch,
+    'csv_fast': bench_csv_fast,
+    'eval': bench_eval,
+    'deep': bench_deep,
+    'recalc': bench_recalc,
+    'suite': bench_suite,
+}
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark arguments")
+    arg_parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+            help='Benchmarks to run (default: all of %s)' % ', '.join(sorted(BENCHMARKS)))
+    arg_parser.add_argument('--size', dest='size', action='store', default=100000, type=int,
+            help='Size of the synthetic inputs (operators or fields)')
+    arg_parser.add_argument('--repeat', dest='repeat', action='store', default=3, type=int,
+            help='Runs per measurement; the best one is reported')
+    arg_parser.add_argument('--save', dest='save', action='store', default=None, type=str,
+            help='Save the suite results as a JSON baseline')
+    arg_parser.add_argument('--baseline', dest='baseline', action='store', default=None, type=str,
+            help='Compare the suite results against a JSON baseline')
+    arg_parser.add_argument('--threshold', dest='threshold', action='store',
+            default=REGRESSION_THRESHOLD, type=float,
+            help='Fraction a suite result may be worse than the baseline by')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    regressions = 0
+    for name in args.benchmarks:
+        regressions += BENCHMARKS[name](args) or 0
+    sys.exit(1 if regressions else 0)
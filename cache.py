@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# A small bounded LRU mapping with hit/miss/eviction counters.
+# Used for the process-wide compiled-lexer registry (see lexer.py).
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A mapping that holds at most maxsize entries, evicting the
+        least recently used one when a new entry does not fit.
+        Safe to share between threads.
+    """
+    def __init__(self, maxsize=128):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """ Return the entry for key (marking it as most recently
+            used), or default if there is none.
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Add or replace the entry for key, evicting the least
+            recently used entries if the cache is full.
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def values(self):
+        with self.lock:
+            return list(self.entries.values())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """ The counters and current size, as a dict.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+        }
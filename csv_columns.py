@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# Columnar CSV output with type inference.
+#
+# The records from CsvParser are split into columns as they are parsed. Each
+# column is first collected as a StringColumn (utf-8 data plus an offsets
+# array, no Python object per value); when the input is done every column is
+# converted to the narrowest type that holds all its values:
+#   int    -> array('q')
+#   float  -> array('d') (empty values become NaN)
+#   string -> StringColumn
+# Only plain decimal numbers count (42, -7, 1.5, .5e-3): values that int()
+# and float() would also take, such as " 12", "1_000", "inf" or "nan", keep
+# their column a string column.
+# Rows shorter than the widest row are padded with empty values.
+
+import argparse
+import math
+import re
+from array import array
+
+import csv_parser
+
+# The values inferred as numbers
+INT_PATTERN = re.compile(r'[+-]?[0-9]+')
+FLOAT_PATTERN = re.compile(r'[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?')
+
+
+class StringColumn(object):
+    """ A column of strings stored as one utf-8 buffer plus the end
+        offset of every value in it.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value):
+        self.data += value.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def pad(self, count):
+        """ Append count empty values.
+        """
+        self.offsets.extend([len(self.data)] * count)
+
+
+#the narrowest type holding all values of a string column, and the column
+#converted to it
+def infer(column):
+    if len(column) == 0:
+        return 'str', column
+    strings = list(column)
+    if all(INT_PATTERN.fullmatch(value) for value in strings):
+        try:
+            return 'int', array('q', [int(value) for value in strings])
+        except OverflowError:
+            pass
+    if not all(FLOAT_PATTERN.fullmatch(value) for value in strings if value):
+        return 'str', column
+    values = array('d', [float(value) if value else math.nan for value in strings])
+    if all(math.isnan(value) for value in values):
+        # nothing but empty values
+        return 'str', column
+    return 'float', values
+
+
+class Columns(object):
+    """ A parsed CSV file as columns.
+
+        names:
+            The header fields, if the first record was taken as a
+            header, else None.
+
+        columns, types:
+            The columns (array('q'), array('d') or StringColumn) and
+            their inferred types ('int', 'float' or 'str').
+    """
+    def __init__(self, names, columns, types):
+        self.names = names
+        self.columns = columns
+        self.types = types
+
+    def __len__(self):
+        """ The number of rows.
+        """
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __getitem__(self, key):
+        """ A column, by index or by header name.
+        """
+        if isinstance(key, str):
+            key = self.names.index(key)
+        return self.columns[key]
+
+    def to_dict(self):
+        """ The columns as lists, keyed by name (or index).
+        """
+        names = self.names or list(range(len(self.columns)))
+        return dict((name, list(column)) for name, column in zip(names, self.columns))
+
+    def to_numpy(self, key):
+        """ A column as a NumPy array; numeric columns share their
+            buffer with the array. Needs numpy.
+        """
+        import numpy
+        column = self[key]
+        if isinstance(column, StringColumn):
+            return numpy.array(list(column), dtype=object)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+
+#turn an iterable of records (sequences of field strings) into Columns
+def to_columns(records, header=False):
+    names = None
+    columns = []
+    rows = 0
+    for record in records:
+        if header and names is None:
+            names = list(record)
+            continue
+        i = -1
+        for i, value in enumerate(record):
+            if i == len(columns):
+                # a new, wider row: add a column padded up to here
+                columns.append(StringColumn())
+                columns[i].pad(rows)
+            columns[i].append(value)
+        for column in columns[i + 1:]:
+            column.pad(1)
+        rows += 1
+
+    types = []
+    for i, column in enumerate(columns):
+        type, columns[i] = infer(column)
+        types.append(type)
+    if names is not None and len(names) < len(columns):
+        names.extend(str(i) for i in range(len(names), len(columns)))
+    return Columns(names, columns, types)
+
+
+#parse a CSV input (see CsvParser.records) into Columns
+def parse_columns(input, header=False, parser=None):
+    if parser is None:
+        parser = csv_parser.CsvParser(trace=False)
+    parser.action = None
+    return to_columns(parser.records(input), header)
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Columnar CSV arguments")
+    arg_parser.add_argument('--file', dest='file', action='store', required=True, type=str,
+            help='CSV file to parse')
+    arg_parser.add_argument('--header', help="take the first record as the column names",
+            action="store_true")
+    arg_parser.add_argument('--mmap', help="memory-map the file and parse it in place",
+            action="store_true")
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.mmap:
+        cols = parse_columns(csv_parser.map_file(args.file), args.header)
+    else:
+        with open(args.file) as f:
+            cols = parse_columns(f, args.header)
+
+    names = cols.names or [str(i) for i in range(len(cols.columns))]
+    print("%-20s %-6s %10s" % ("column", "type", "rows"))
+    for name, type, column in zip(names, cols.types, cols.columns):
+        print("%-20s %-6s %10d" % (name, type, len(column)))
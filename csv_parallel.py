@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# Parallel CSV parsing over a process pool.
+#
+# The file is cut into byte ranges of about chunk_size bytes. Every cut is
+# moved forward to the start of the next record: the first newline that is
+# not inside a QUOTE ... QUOTE field. Whether a cut point is inside quotes
+# follows from the parity of the quotes before it, which one pass of
+# bytes.count() over the file gives (the grammar has no escaped quotes).
+# Each range is then parsed by a CsvParser in a worker process, and the
+# records come back either in file order or range by range as they finish.
+# Records are split on "\n", so files with bare "\r" line ends are parsed as
+# a single range.
+
+import argparse
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import csv_parser
+from parser import ParseError
+
+# Default size of the byte ranges handed to the workers
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Size of the blocks read while scanning for quotes and record starts
+BLOCK_SIZE = 1024 * 1024
+
+
+#number of quotes in f between offsets start and end
+def count_quotes(f, start, end):
+    f.seek(start)
+    count = 0
+    left = end - start
+    while left > 0:
+        block = f.read(min(BLOCK_SIZE, left))
+        if not block:
+            break
+        count += block.count(b'"')
+        left -= len(block)
+    return count
+
+
+#offset of the first record starting at or after offset, given whether
+#offset is inside a quoted field; the size of the file if there is none
+def record_start(f, offset, inside):
+    f.seek(offset)
+    pos = offset
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return pos
+        i = 0
+        while True:
+            quote = block.find(b'"', i)
+            if not inside:
+                newline = block.find(b'\n', i)
+                if newline >= 0 and (quote < 0 or newline < quote):
+                    return pos + newline + 1
+            if quote < 0:
+                break
+            inside = not inside
+            i = quote + 1
+        pos += len(block)
+
+
+#split a file into (start, end) byte ranges that begin and end on record
+#boundaries
+def split_ranges(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        quotes = 0
+        while start < size:
+            cut = start + chunk_size
+            if cut >= size:
+                ranges.append((start, size))
+                break
+            quotes += count_quotes(f, start, cut)
+            end = record_start(f, cut, quotes % 2 == 1)
+            quotes += count_quotes(f, cut, end)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+# parser of the current worker process, created on first use
+worker_parser = None
+
+
+#parse one byte range of a file (runs in a worker process); action is
+#the parser's semantic action, and has to be picklable. A ParseError
+#gives its byte offset in the file.
+def parse_range(path, start, end, encoding='utf-8', action=None):
+    global worker_parser
+    if worker_parser is None:
+        worker_parser = csv_parser.CsvParser(trace=False)
+    worker_parser.action = action
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode(encoding)
+    try:
+        return list(worker_parser.records(text))
+    except ParseError as err:
+        # the position is a character offset into the range
+        offset = start + len(text[:err.pos].encode(encoding))
+        raise ParseError(offset, err.msg) from None
+
+
+#parse a CSV file in parallel and yield its records; with ordered=False the
+#records of each range are yielded as soon as it is done
+def parse_parallel(path, jobs=None, ordered=True, chunk_size=DEFAULT_CHUNK_SIZE,
+        encoding='utf-8', action=None):
+    jobs = jobs or os.cpu_count() or 1
+    ranges = iter(split_ranges(path, chunk_size))
+    # keep a bounded number of ranges in flight so that results
+    # don't pile up in memory
+    in_flight = 2 * jobs
+
+    with ProcessPoolExecutor(jobs) as pool:
+        def submit():
+            for start, end in ranges:
+                return pool.submit(parse_range, path, start, end, encoding, action)
+            return None
+
+        pending = collections.deque()
+        for i in range(in_flight):
+            future = submit()
+            if future is None:
+                break
+            pending.append(future)
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                pending = collections.deque(f for f in pending if f not in done)
+            for future in done:
+                for record in future.result():
+                    yield record
+                future = submit()
+                if future is not None:
+                    pending.append(future)
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Parallel CSV parser arguments")
+    arg_parser.add_argument('--file', dest='file', action='store', required=True, type=str,
+            help='CSV file to parse')
+    arg_parser.add_argument('--jobs', dest='jobs', action='store', default=None, type=int,
+            help='Number of worker processes (default: number of CPUs)')
+    arg_parser.add_argument('--chunk-size', dest='chunk_size', action='store',
+            default=DEFAULT_CHUNK_SIZE, type=int, help='Bytes per range handed to a worker')
+    arg_parser.add_argument('--unordered', help="yield records as ranges finish, not in file order",
+            action="store_true")
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    for result in parse_parallel(args.file, args.jobs, not args.unordered, args.chunk_size,
+            action=csv_parser.space_join):
+        print(result)
@@ -10,42 +10,134 @@
 # [1] https://tomassetti.me/ebnf/
 
 # The grammar is:
-# start: field (COMMA field)* 
-# field: QUOTE ( COMMA | STRING )* QUOTE | STRING
+# file: record (NEWLINE record)*
+# start: record
+# record: field (COMMA field)*
+# field: QUOTE ( COMMA | STRING | NEWLINE )* QUOTE | STRING
 # COMMMA : ,
 # QUOTE : "
-# STRING: [^,"] #all strings not matching comma or quotes
+# NEWLINE : \r\n | \r | \n
+# STRING: [^,"\r\n] #all strings not matching comma, quotes or newlines
 # Note: Grammar does not allows nested quotes. TODO: Make it nested.
+# start parses a single record (e.g. --input), records() a whole file.
 
-from parser import Parser
+from parser import Parser, ParseError
+import itertools
 import logging
+import mmap
+import os
 import sys
 import trace
+import lexer
+import profiling
+
+# lexer rules for the grammar above
+RULES = [
+    ('\,',             'COMMA'),
+    ('\"',             'QUOTE'),
+    ('\r\n?|\n',        'NEWLINE'),
+    ('[^,"\r\n]*',       'STRING'),
+]
+
+#map a file read-only, for parsing it in place (see CsvParser.feed)
+def map_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MappedRecord(object):
+    """ A record of a bytes-like (e.g. memory-mapped) input. It holds
+        the offsets of each field's pieces in the buffer, and decodes
+        a field only when it is accessed.
+    """
+    __slots__ = ("buf", "spans", "encoding")
+
+    def __init__(self, buf, spans, encoding="utf-8"):
+        self.buf = buf
+        self.spans = spans
+        self.encoding = encoding
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, i):
+        pieces = self.spans[i]
+        buf = self.buf
+        if len(pieces) == 2:
+            data = buf[pieces[0]:pieces[1]]
+        else:
+            data = b"".join(buf[pieces[j]:pieces[j + 1]]
+                    for j in range(0, len(pieces), 2))
+        # slices of a memoryview are memoryviews, which have no decode()
+        return str(data, self.encoding)
+
+    def __iter__(self):
+        for i in range(len(self.spans)):
+            yield self[i]
+
+    def __repr__(self):
+        return "MappedRecord(%r)" % list(self)
+
+
+# Built-in semantic actions (see CsvParser)
+
+#replace the commas by spaces, dropping empty fields
+def space_join(fields):
+    return " ".join([field for field in fields if field]) or None
+
+
+# Separators of the quote-free fast path (see CsvParser.records), for str
+# and bytes-like buffers: newline, comma, quote, carriage return and the
+# blanks skipped before a field (skip_whitespace)
+FAST_STR = ('\n', ',', '"', '\r', ' \t\f\v')
+FAST_BYTES = (b'\n', b',', b'"', b'\r', b' \t\f\v')
+
+# Most characters the fast path splits in one go
+FAST_BLOCK_SIZE = 1024 * 1024
+
+
+#end of the lines starting at pos that hold whole quoted fields (an even
+#number of quotes), just past their last newline; -1 if the buffer ends
+#first
+def balanced_end(buf, pos, quote, newline):
+    inside = False
+    while True:
+        nl = buf.find(newline, pos)
+        if nl < 0:
+            return -1
+        if buf[pos:nl].count(quote) % 2:
+            inside = not inside
+        if not inside:
+            return nl + 1
+        pos = nl + 1
+
 
 # Implements a recursive descent parser for thea above grammar(csv)
 # Since this is LL(1) no backtracking is needed
 class CsvParser(Parser):
 
-    def __init__(self, rules):
-        Parser.__init__(self,rules)
-
-    # we have lhs,rhs...what do you wish to do
-    def sem_action(self,s1,s2):
-        action = ' '
-        if s1 and s2:
-            if len(s1) > 0 and len(s2) > 0:
-                logging.debug("s1 is {} s2 is {}".format(s1,s2))
-                return s1 + action + s2
-            elif len(s1) > 0 :
-                return s1
-            else: 
-                return s2
-        elif s1:
-            return s1
-        elif s2:
-            return s2
-
-        return None
+    productions = ("start", "record", "field")
+
+    # newlines end a record, so only skip blanks
+    skip_whitespace = r'[ \t\f\v]*'
+
+    def __init__(self, rules=RULES, trace=None, encoding="utf-8", action=None):
+        Parser.__init__(self, rules, trace)
+        # semantic action: called with the list of fields of every
+        # record, its result is what the parser returns for the record
+        # (None: return the fields themselves)
+        self.action = action
+        # encoding of bytes-like and binary inputs
+        self.encoding = encoding
+        self.spans = False
+        self.binary = False
+        # the fast path of records() splits lines the way the
+        # productions would with these rules only
+        self.fast_ok = (rules is RULES and
+                self.skip_whitespace == CsvParser.skip_whitespace)
 
     #stringify none
     def sn(self, string):
@@ -53,60 +145,221 @@ class CsvParser(Parser):
             return ""
         return str(string)
 
+    #hand the input to the lexer (see Parser.feed); fields of a
+    #bytes-like buffer (e.g. a memory-mapped file) are kept as
+    #offsets into it instead of being decoded
+    def feed(self, input):
+        Parser.feed(self, input)
+        self.spans = isinstance(input, (bytes, bytearray, memoryview, mmap.mmap))
+        self.binary = not isinstance(self.lx.buf, str)
+
+    #add the current token to the pieces of a field: its value, or
+    #in span mode its offsets (merged with the previous piece when
+    #they are adjacent)
+    def take(self, pieces):
+        tok = self.cur_token
+        if self.spans:
+            end = tok.pos + len(tok.val)
+            if pieces and pieces[-1] == tok.pos:
+                pieces[-1] = end
+            else:
+                pieces.append(tok.pos)
+                pieces.append(end)
+        else:
+            pieces.append(tok.val)
+
     def field (self):
-        self.dts(sys._getframe().f_code.co_name)
-        s = ""
-        if self.match("STRING"):
-            s = self.sn(self.gsft())
+        pieces = []
+        if self.match(self.STRING):
+            self.take(pieces)
 
-        if self.match("QUOTE"):
-            s = s + "\""
+        if self.match(self.QUOTE):
+            self.take(pieces)
             while True:
-                if self.match("COMMA"):
-                    s = s + ","
+                if self.match(self.COMMA):
+                    self.take(pieces)
 
-                if self.match("STRING"):
-                    s = s + self.sn(self.gsft())
+                if self.match(self.STRING):
+                    self.take(pieces)
 
-                if self.match("QUOTE"):
-                    s = s + "\""
+                if self.match(self.NEWLINE):
+                    self.take(pieces)
+
+                if self.match(self.QUOTE):
+                    self.take(pieces)
                     break
 
                 if self.cnt() is False:
                     logging.critical("Improperly nested QUOTE ")
                     break
-        return s
+
+        if self.spans:
+            return tuple(pieces)
+        if self.binary:
+            return b"".join(pieces).decode(self.encoding)
+        return "".join(pieces)
+
+    def record(self):
+        fields = [self.field()]
+        while self.match(self.COMMA):
+            fields.append(self.field())
+
+        # a record ends at a newline or at the end of the input
+        if not self.match(self.NEWLINE) and self.cnt():
+            raise ParseError(self.next_token.pos,
+                    "Unexpected {}".format(self.next_token.type))
+        if self.spans:
+            fields = MappedRecord(self.lx.buf, fields, self.encoding)
+        if self.action is not None:
+            return self.action(fields)
+        return fields
 
     def start(self):
         self.gnt()
-        self.dts(sys._getframe().f_code.co_name)
-        s1 = self.field()
-        s3 = ""
-        while True:
-            if self.match("COMMA"):
-                s2 = self.field() 
-                #s3 = s3 + s2 + " "
-                s3 = self.sem_action(s3, s2)
-            self.dts(sys._getframe().f_code.co_name)
-
-            if self.cnt() is False:
+        try:
+            result = self.record()
+        except ParseError as err:
+            logging.critical("%s", err)
+            return False, None
+        return not self.cnt(), result
+
+    #file mode: parse the input (a string, buffer or file object, see
+    #feed) and yield the result of every record. The same lexer and
+    #parser are used for the whole stream.
+    #With fast (default: unless tracing or profiling), lines without
+    #quotes or carriage returns are split with str/bytes.split() instead
+    #of going through the productions, which only see the lines with
+    #quotes; the records are the same either way.
+    def records(self, input, fast=None):
+        if fast is None:
+            fast = not self.tracing and self.profiler is None
+        fast = fast and self.fast_ok
+        if fast and isinstance(input, (str, bytes, bytearray, mmap.mmap)):
+            self.feed(input)
+            yield from self.scan(input, 0, True)
+            return
+        if fast and not isinstance(input, memoryview):
+            if hasattr(input, 'read'):
+                chunks = lexer.read_chunks(input)
+            else:
+                chunks = iter(input)
+            first = next(chunks, '')
+            if isinstance(first, str):
+                yield from self.scan_stream(first, chunks)
+                return
+            # binary streams are decoded by the productions
+            input = itertools.chain([first], chunks)
+
+        self.feed(input)
+        self.gnt()
+        while self.cnt():
+            yield self.record()
+
+    #fast path over a streamed text input: scan the complete lines of
+    #each chunk and carry the rest over to the next one
+    def scan_stream(self, text, chunks):
+        self.spans = False
+        self.binary = False
+        base = 0
+        for chunk in chunks:
+            text += chunk
+            self.lx.input(text)
+            self.lx.base = base
+            pos = yield from self.scan(text, base, False)
+            text = text[pos:]
+            base += pos
+        self.lx.input(text)
+        self.lx.base = base
+        yield from self.scan(text, base, True)
+
+    #yield the records of buf (the lexer's buffer, starting at offset
+    #base of the input): runs of quote-free lines are split directly,
+    #the lines from a quote (or carriage return) up to the end of its
+    #field are parsed by the productions. Unless final, stops before
+    #an incomplete line or quoted field and returns where it stopped.
+    def scan(self, buf, base, final):
+        newline, comma, quote, cr, blanks = (FAST_STR if isinstance(buf, str)
+                else FAST_BYTES)
+        end = len(buf)
+        pos = 0
+        # next quote and carriage return, found again once passed
+        next_quote = next_cr = -1
+        while pos < end:
+            if next_quote < pos:
+                next_quote = buf.find(quote, pos)
+                if next_quote < 0:
+                    next_quote = end
+            if next_cr < pos:
+                next_cr = buf.find(cr, pos)
+                if next_cr < 0:
+                    next_cr = end
+            stop = min(next_quote, next_cr)
+            if stop == end and final:
+                fast_end = end
+            else:
+                fast_end = buf.rfind(newline, pos, stop) + 1
+            if fast_end > pos:
+                yield from self.split_lines(buf, pos, fast_end, base,
+                        newline, comma, blanks)
+                pos = fast_end
+            if stop == end:
                 break
 
-        result = self.sem_action(s1,s3)
-        logging.debug("result is {}".format(result))
-        return True, result
+            seg_end = balanced_end(buf, pos, quote, newline)
+            if seg_end < 0:
+                if not final:
+                    break
+                seg_end = end
+            self.lx.pos = pos
+            self.lx.end = seg_end
+            self.gnt()
+            while self.cnt():
+                yield self.record()
+            pos = seg_end
+        return pos
 
-if __name__ == '__main__':
-    rules = [
-        ('\,',             'COMMA'),
-        ('\"',             'QUOTE'),
-        ('[^,"]*',             'STRING'),
-    ]
+    #yield the records of the quote-free lines of buf[pos:end], split
+    #a block at a time; fields lose their leading blanks, as they would
+    #when skipped by the lexer
+    def split_lines(self, buf, pos, end, base, newline, comma, blanks):
+        action = self.action
+        while pos < end:
+            stop = min(end, pos + FAST_BLOCK_SIZE)
+            if stop < end:
+                cut = buf.rfind(newline, pos, stop) + 1
+                if cut <= pos:
+                    cut = buf.find(newline, stop, end) + 1 or end
+                stop = cut
+            lines = buf[pos:stop].split(newline)
+            # a trailing newline, or blanks after the last one, end
+            # the input without another record
+            if not lines[-1].lstrip(blanks):
+                lines.pop()
+
+            if self.spans:
+                offset = base + pos
+                records = []
+                for line in lines:
+                    spans = []
+                    for field in line.split(comma):
+                        size = len(field)
+                        skip = size - len(field.lstrip(blanks))
+                        spans.append((offset + skip, offset + size) if skip < size else ())
+                        offset += size + 1
+                    records.append(MappedRecord(buf, spans, self.encoding))
+            else:
+                records = [[field.lstrip(blanks) for field in line.split(comma)]
+                        for line in lines]
+            if action is not None:
+                records = [action(record) for record in records]
+            yield from records
+            pos = stop
 
+if __name__ == '__main__':
     tracer = trace.Trace( ignoredirs=[sys.prefix, sys.exec_prefix],
 	trace=1, count=0)
 
-    cp = CsvParser(rules)
+    cp = CsvParser(RULES, action=space_join)
     args = cp.parse_arguments()
     if args.verbose:
         level=logging.DEBUG
@@ -115,11 +368,35 @@ if __name__ == '__main__':
 
     FORMAT = "%(levelname)s[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s"
     logging.basicConfig(format=FORMAT, level=level)
+    # trace now that logging is set up
+    cp.set_trace()
 
     #cp.parse("5,6,7")
+    if args.file == "-":
+        source = sys.stdin
+    elif args.file:
+        source = open(args.file)
+    else:
+        source = args.input
+
+    def run():
+        if args.mmap:
+            for result in cp.records(map_file(args.file)):
+                print(result)
+        elif args.file:
+            for result in cp.records(source):
+                print(result)
+        else:
+            cp.parse(source)
+
     if args.trace:
-        tracer.run("cp.parse(args.input)")
+        tracer.run("run()")
+    elif args.profile:
+        cp.set_trace(False)
+        prof = profiling.Profiler(cp).attach()
+        run()
+        print(prof.format(args.profile), file=sys.stderr)
     else:
-        cp.parse(args.input)
+        run()
     
 
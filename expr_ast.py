@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+# Abstract syntax trees of the calculator expressions.
+# The CalcParsers (expr_bnf_parser, expr_ebnf_parser) build these trees
+# instead of evaluating while they parse; CalcParser.compile() returns an
+# Expression, which can then be evaluated against any number of variable
+# bindings without lexing or parsing the text again.
+#
+# Usage:
+#   e = CalcParser(RULES).compile("x*8+7")
+#   e.evaluate({"x": 2})        -> 23
+#   e.evaluate({"x": 5})        -> 47
+import operator
+
+# Default number of compiled statements a CalcParser keeps by their text
+COMPILE_CACHE_SIZE = 1024
+
+# Integer powers whose result would have more than this many bits raise
+# OverflowError instead of keeping the process busy (2^3^4^5 would never
+# finish)
+MAX_POWER_BITS = 1 << 20
+
+
+#a ** b, refusing integer powers too big to compute
+def power(a, b):
+    if (isinstance(a, int) and isinstance(b, int) and b > 0 and abs(a) > 1 and
+            b * abs(a).bit_length() > MAX_POWER_BITS):
+        raise OverflowError("power too big")
+    return a ** b
+
+
+# The binary operators, by their token text
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': power,
+}
+
+
+class EvalError(Exception):
+    """ Evaluation error exception: an identifier that has no value.
+
+        name:
+            The identifier.
+    """
+    def __init__(self, name):
+        Exception.__init__(self, "Identifier %s not set" % name)
+        self.name = name
+
+
+class Node(object):
+    """ Base class of the tree nodes.
+    """
+    __slots__ = ()
+
+    def evaluate(self, env):
+        """ The value of the node, with identifiers looked up in the
+            mapping env. EvalError is raised for an unbound one.
+        """
+        raise NotImplementedError()
+
+    def operands(self):
+        """ The nodes this one is computed from.
+        """
+        return ()
+
+    def names(self):
+        """ The identifiers used by the node (a set). The tree is
+            walked with an explicit stack, so any depth will do.
+        """
+        names = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Var):
+                names.add(node.name)
+            else:
+                stack.extend(node.operands())
+        return names
+
+
+class Num(Node):
+    """ A number literal.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, env):
+        return self.value
+
+    def __reduce__(self):
+        return (Num, (self.value,))
+
+    def __repr__(self):
+        return "Num(%r)" % (self.value,)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class Var(Node):
+    """ An identifier, looked up when evaluated.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, env):
+        try:
+            return env[self.name]
+        except KeyError:
+            raise EvalError(self.name) from None
+
+    def __reduce__(self):
+        return (Var, (self.name,))
+
+    def __repr__(self):
+        return "Var(%r)" % (self.name,)
+
+    def __str__(self):
+        return self.name
+
+
+class BinOp(Node):
+    """ A binary operation; op is one of the OPERATORS.
+    """
+    __slots__ = ("op", "left", "right", "fn")
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.fn = OPERATORS[op]
+
+    def evaluate(self, env):
+        return self.fn(self.left.evaluate(env), self.right.evaluate(env))
+
+    def operands(self):
+        return (self.left, self.right)
+
+    def __reduce__(self):
+        return (BinOp, (self.op, self.left, self.right))
+
+    def __repr__(self):
+        return "BinOp(%r, %r, %r)" % (self.op, self.left, self.right)
+
+    def __str__(self):
+        return "(%s %s %s)" % (self.left, self.op, self.right)
+
+
+class Sum(Node):
+    """ The sum of the EBNF expr production: the first term plus the
+        running total of the others, each added or negated and added
+        (terms is a tuple of ('+' or '-', node) pairs). The order of
+        the additions is the parser's, so float results don't change.
+    """
+    __slots__ = ("first", "terms")
+
+    def __init__(self, first, terms):
+        self.first = first
+        self.terms = tuple(terms)
+
+    def evaluate(self, env):
+        first = self.first.evaluate(env)
+        rest = 0
+        for op, node in self.terms:
+            value = node.evaluate(env)
+            if op == '-':
+                value = -value
+            rest = rest + value
+        return first + rest
+
+    def operands(self):
+        return (self.first,) + tuple(node for op, node in self.terms)
+
+    def __reduce__(self):
+        return (Sum, (self.first, self.terms))
+
+    def __repr__(self):
+        return "Sum(%r, %r)" % (self.first, self.terms)
+
+    def __str__(self):
+        return "(%s%s)" % (self.first, "".join(
+                " %s %s" % (op, node) for op, node in self.terms))
+
+
+class Expression(object):
+    """ A compiled statement: an expression (tree), and for a
+        `set ID = expr` statement the name it is assigned to
+        (target, else None).
+
+        names:
+            The identifiers the expression needs bindings for.
+    """
+    def __init__(self, tree, target=None, text=None):
+        self.tree = tree
+        self.target = target
+        self.text = text
+        self.names = frozenset(tree.names())
+
+    def evaluate(self, bindings):
+        """ The value of the expression with the identifiers bound
+            by the mapping bindings.
+        """
+        return self.tree.evaluate(bindings)
+
+    def execute(self, vars):
+        """ Run the statement against the variables vars (a dict):
+            evaluate it, and for a set statement store the value
+            (as an int, like the parsers do) in vars.
+        """
+        value = self.tree.evaluate(vars)
+        if self.target is not None:
+            vars[self.target] = int(value)
+        return value
+
+    def __repr__(self):
+        if self.target is not None:
+            return "Expression(set %s = %s)" % (self.target, self.tree)
+        return "Expression(%s)" % (self.tree,)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Batch evaluation of calculator statements over a worker pool.
+#
+# Lexing and parsing is most of the cost of a statement, so that is what
+# the workers do: each one compiles a chunk of statements (see
+# CalcParser.compile) and sends the trees back. The trees are then run in
+# the order of the input against one dict of variables, so a statement sees
+# the values of all the `set` statements before it, exactly as if they were
+# parsed one after another. Every statement gets a Result, with the error
+# message instead of a value if it fails to parse or evaluate; nothing
+# exits the process.
+# The trees are pickled on their way back from worker processes, which
+# costs about a third of compiling them, so processes pay off with a few
+# cores; threads share the trees but parse under the GIL.
+#
+# Usage:
+#   for result in evaluate_batch(["set x = 2", "x*8+7", "y+1"]):
+#       print(result)
+import argparse
+import collections
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import expr_bnf_parser
+import expr_ebnf_parser
+import expr_iterative_parser
+import expr_optimize
+from expr_ast import EvalError
+from lexer import LexerError
+from parser import ParseError
+
+# The parser modules by grammar name
+GRAMMARS = {
+    'bnf': expr_bnf_parser,
+    'ebnf': expr_ebnf_parser,
+    'iterative': expr_iterative_parser,
+}
+
+# Statements handed to a worker at a time
+CHUNK_SIZE = 256
+
+# parsers of the current worker (thread or process), created on first use
+worker = threading.local()
+
+
+class Result(object):
+    """ The outcome of one statement of a batch.
+
+        index:
+            Position of the statement in the input (from 0).
+
+        value, error:
+            Its value, or the message of the error that stopped it
+            (None when it succeeded).
+    """
+    __slots__ = ("index", "text", "value", "error")
+
+    def __init__(self, index, text, value=None, error=None):
+        self.index = index
+        self.text = text
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is not None:
+            return "Result(%d, %r, error=%r)" % (self.index, self.text, self.error)
+        return "Result(%d, %r, %r)" % (self.index, self.text, self.value)
+
+
+#the message of a statement's error
+def error_message(err):
+    if isinstance(err, LexerError):
+        return "LexerError: Unexpected character at %s" % err.pos
+    return "%s: %s" % (type(err).__name__, err)
+
+
+#the parser of a grammar for the current worker
+def worker_parser(grammar):
+    parsers = getattr(worker, "parsers", None)
+    if parsers is None:
+        parsers = worker.parsers = {}
+    cp = parsers.get(grammar)
+    if cp is None:
+        module = GRAMMARS[grammar]
+        cp = parsers[grammar] = module.CalcParser(module.RULES, trace=False)
+    return cp
+
+
+#compile a chunk of statements (runs in a worker); each one becomes an
+#Expression, or the message of its parse error (or of the RecursionError
+#of one nested too deep for the recursive parsers)
+def compile_chunk(texts, grammar='ebnf', optimize=False):
+    cp = worker_parser(grammar)
+    compiled = []
+    for text in texts:
+        try:
+            expression = cp.compile(text)
+            if optimize:
+                expression = expr_optimize.optimize(expression)
+        except (ParseError, LexerError, RecursionError) as err:
+            expression = error_message(err)
+        compiled.append(expression)
+    return compiled
+
+
+#run a compiled statement (or report its parse error) against vars
+def run_statement(index, text, compiled, vars):
+    if isinstance(compiled, str):
+        return Result(index, text, error=compiled)
+    try:
+        value = compiled.execute(vars)
+    except (EvalError, ArithmeticError, ValueError, TypeError, RecursionError) as err:
+        return Result(index, text, error=error_message(err))
+    return Result(index, text, value)
+
+
+#evaluate statements (an iterable of strings, e.g. a file; blank ones are
+#skipped) with their parsing spread over a pool of jobs processes, or
+#threads; yields a Result per statement, in order. vars holds the
+#variables, and is updated by the set statements.
+def evaluate_batch(statements, jobs=None, threads=False, grammar='ebnf', vars=None,
+        optimize=False, chunk_size=CHUNK_SIZE):
+    if grammar not in GRAMMARS:
+        raise ValueError("Unknown grammar %s" % grammar)
+    if vars is None:
+        vars = {}
+    jobs = jobs or os.cpu_count() or 1
+    items = ((index, text.strip()) for index, text in enumerate(statements))
+    items = ((index, text) for index, text in items if text)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    # keep a bounded number of chunks in flight so that a long input
+    # isn't read (or compiled) ahead all at once
+    in_flight = 2 * jobs
+
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor(jobs) as pool:
+        def submit():
+            for chunk in chunks:
+                texts = [text for index, text in chunk]
+                return chunk, pool.submit(compile_chunk, texts, grammar, optimize)
+            return None
+
+        pending = collections.deque()
+        for i in range(in_flight):
+            work = submit()
+            if work is None:
+                break
+            pending.append(work)
+
+        while pending:
+            chunk, future = pending.popleft()
+            try:
+                results = future.result()
+            except Exception:
+                # the chunk as a whole failed in the worker (e.g. a tree
+                # too deep to pickle back): compile it here, where every
+                # statement gets its own result
+                results = compile_chunk([text for index, text in chunk], grammar, optimize)
+            for (index, text), compiled in zip(chunk, results):
+                yield run_statement(index, text, compiled, vars)
+            work = submit()
+            if work is not None:
+                pending.append(work)
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Batch evaluation arguments")
+    arg_parser.add_argument('--file', dest='file', action='store', required=True, type=str,
+            help='File of statements, one per line (- for stdin)')
+    arg_parser.add_argument('--jobs', dest='jobs', action='store', default=None, type=int,
+            help='Number of workers (default: number of CPUs)')
+    arg_parser.add_argument('--threads', help="use a thread pool instead of processes",
+            action="store_true")
+    arg_parser.add_argument('--grammar', dest='grammar', action='store', default='ebnf',
+            choices=sorted(GRAMMARS), help='Grammar of the statements')
+    arg_parser.add_argument('--optimize', help="optimize the compiled statements (see expr_optimize)",
+            action="store_true")
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    source = sys.stdin if args.file == "-" else open(args.file)
+    failed = 0
+    for result in evaluate_batch(source, args.jobs, args.threads, args.grammar,
+            optimize=args.optimize):
+        if result.ok:
+            print("%d: %s" % (result.index + 1, result.value))
+        else:
+            failed += 1
+            print("%d: error: %s" % (result.index + 1, result.error))
+    sys.exit(1 if failed else 0)
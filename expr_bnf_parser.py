@@ -33,25 +33,62 @@ import logging
 import sys
 #Please see README on how to get this lexer
 import lexer
+import tracing
+from parser import ParseError
+from cache import LRUCache
+from expr_ast import COMPILE_CACHE_SIZE, Num, Var, BinOp, Expression, EvalError
+import profiling
+
+# lexer rules for the grammar above
+RULES = [
+    ('set',             'SET'),
+    ('\d+',             'NUMBER'),
+    ('[a-zA-Z_]\w*',    'IDENTIFIER'),
+    ('\+',              'PLUS'),
+    ('\-',              'MINUS'),
+    ('\*',              'MULTIPLY'),
+    ('\/',              'DIVIDE'),
+    ('\(',              'LP'),
+    ('\)',              'RP'),
+    ('=',               'EQUALS'),
+]
 
 # Implements a recursive descent parser for a specific grammer(calculator)
 # Since this is LL(1) no backtracking is needed
 class CalcParser(object):
 
-    def __init__(self, rules):
+    # the productions (non-terminal methods) of the grammar, which are
+    # wrapped when tracing is on
+    productions = ("start", "statement", "expr", "term", "factor")
+
+    def __init__(self, rules, trace=None, cache_size=COMPILE_CACHE_SIZE):
         # initialize the lex rules for the grammer 
         self.lx = lexer.Lexer(rules, skip_whitespace=True)
+        # bind each token type to its integer kind (e.g. self.NUMBER)
+        # so that match() compares ints rather than type strings
+        for type, kind in self.lx.kinds.items():
+            setattr(self, type, kind)
         # current result (do we need this ?)
         self.result=0
         self.cur_token = None
         self.next_token = None
         # dictionary for variables (e.g. set x  = 10)
         self.vars = {}
+        # compiled statements by their text (see compile); the values
+        # depend on self.vars, so only the trees are cached
+        self.compile_cache = LRUCache(cache_size) if cache_size else None
+        # tracing is bound here, not checked on every token
+        # (None: trace if logging is at INFO or below)
+        self.set_trace(trace)
+
+    #turn tracing of match() and the productions on or off
+    def set_trace(self, enabled=None):
+        return tracing.bind_trace(self, enabled)
 
     #dump token status (including caller info)
     def dts(self, caller=sys._getframe().f_code.co_name):
-        logging.debug("Caller {} \nCurrent token is {} \nNext token is {}".format
-                (caller, self.cur_token, self.next_token));
+        logging.debug("Caller %s \nCurrent token is %s \nNext token is %s",
+                caller, self.cur_token, self.next_token)
 
     #get next token(calls lexer)
     def gnt(self):
@@ -76,98 +113,127 @@ class CalcParser(object):
             token = self.cur_token
         return int(token.val)
 
-    def match(self, type):
-        if (self.next_token and self.next_token.type == type):
-            logging.info("Parsing token {}".format(self.next_token))
+    #match the next token against a token kind (e.g. self.NUMBER)
+    def match(self, kind):
+        if (self.next_token and self.next_token.kind == kind):
             self.update_cur_token(self.next_token)
             self.gnt()
             return True
         return False
 
-    def factor(self):
-        self.dts(sys._getframe().f_code.co_name)
+    #the parse error for the next token, which no production expects
+    def error(self):
+        tok = self.next_token
+        if tok is None:
+            return ParseError(self.lx.base + self.lx.pos, "Unexpected end of input")
+        return ParseError(tok.pos, "Unexpected {}".format(tok.type))
 
-        if self.match("NUMBER"):
-            return self.get_number()
+    def factor(self):
+        if self.match(self.NUMBER):
+            return Num(self.get_number())
 
-        if self.match("IDENTIFIER"):
-            try:
-                return self.vars[self.gct().val]
-            except KeyError:
-                logging.critical("Identifier {} not set".format(self.gct()))
-                sys.exit(1)
+        if self.match(self.IDENTIFIER):
+            return Var(self.gct().val)
         
         #match for ()
-        if self.match("LP"):
+        if self.match(self.LP):
             result = self.expr()
-            if self.match("RP"):
+            if self.match(self.RP):
                 return result
-        return None
+        raise self.error()
 
     def term(self):
-        self.dts(sys._getframe().f_code.co_name)
-    
         #Used for resolving factors (E -> T -> F -> <Number>)
         lhs = self.factor()
 
         # <term>    : <factor> * <term>
-        if self.match("MULTIPLY"):
-            return lhs * self.term()
+        if self.match(self.MULTIPLY):
+            return BinOp('*', lhs, self.term())
         # <term>    : <factor> / <term>
-        if self.match("DIVIDE"):
-            return lhs / self.term()
+        if self.match(self.DIVIDE):
+            return BinOp('/', lhs, self.term())
 
-        logging.debug("result is {}".format(lhs))
         #consumption finished
         return lhs
 
     def expr(self):
-        self.dts(sys._getframe().f_code.co_name)
         #Used for resolving Terms (E -> T -> F * T)
         #Also Used for resolving factors (E -> T -> F -> <Number>)
         lhs  = self.term()
 
         # <expr>    : <term> + <expr>
-        if self.match("PLUS"):
-            return lhs + self.expr()
+        if self.match(self.PLUS):
+            return BinOp('+', lhs, self.expr())
         # <expr>    : <term> - <expr>
-        if self.match("MINUS"):
-            return lhs - self.expr()
+        if self.match(self.MINUS):
+            return BinOp('-', lhs, self.expr())
 
-        logging.debug("result is {}".format(lhs))
         #we have consumed all we can consume now return
         return lhs
 
-    def start(self):
-        self.dts(sys._getframe().f_code.co_name)
-        result = None
-        self.gnt()
-        if self.next_token:
-            #prod1 : set x = 10
-            if self.match("SET"):
-                if self.match("IDENTIFIER") :
-                    lval = self.cur_token.val
-                    if self.match("EQUALS"):
-                        result = self.expr()
-                        if result is not None:
-                            self.vars[lval] = int(result)
-            #prod2 : <expr>
-            else:
-                result = self.expr()
+    #start : expr | set ID = expr, compiled to an Expression
+    def statement(self):
+        target = None
+        #prod1 : set x = 10
+        if self.match(self.SET):
+            if not self.match(self.IDENTIFIER):
+                raise self.error()
+            target = self.cur_token.val
+            if not self.match(self.EQUALS):
+                raise self.error()
+        #prod2 : <expr>
+        tree = self.expr()
 
         if self.next_token:
-            logging.debug("parsing not complete still have is {}".format
-                    (self.next_token))
-            return False
+            logging.debug("parsing not complete still have is %s",
+                    self.next_token)
+            raise self.error()
+        return Expression(tree, target)
 
-        return True, result
+    #parse the statement and run it against self.vars
+    def start(self):
+        self.gnt()
+        try:
+            expression = self.statement()
+        except ParseError as err:
+            logging.debug("%s", err)
+            return False, None
+        return self.run(expression)
+
+    #run a compiled statement against self.vars
+    def run(self, expression):
+        try:
+            return True, expression.execute(self.vars)
+        except EvalError as err:
+            logging.critical("%s", err)
+            sys.exit(1)
+
+    #compile a statement once; the Expression is evaluated against
+    #bindings without lexing or parsing it again. Raises ParseError.
+    #Statements already compiled come from the cache.
+    def compile(self, input):
+        cache = self.compile_cache
+        if cache is not None:
+            expression = cache.get(input)
+            if expression is not None:
+                return expression
+        self.lx.input(input)
+        self.gnt()
+        expression = self.statement()
+        expression.text = input
+        if cache is not None:
+            cache.put(input, expression)
+        return expression
 
 
-    #parse 
+    #parse (or take from the cache) and run
     def parse(self, input="(5+6)"):
         print("input is {}".format(input))
-        self.lx.input(input)
-        success, result = self.start()
+        try:
+            success, result = self.run(self.compile(input))
+        except ParseError as err:
+            logging.debug("%s", err)
+            success, result = False, None
         if success:
             print("Success! Result is {}".format(result))
         else:
@@ -181,6 +247,8 @@ def parse_arguments():
     parser.add_argument('--input', dest='input', action='store', default="5+6", type=str, help='Specify input to parser')
     parser.add_argument("-v", "--verbose", help="increase output verbosity(debug)",
                                 action="store_true")
+    parser.add_argument('--profile', dest='profile', nargs='?', const='text', default=None,
+            choices=['text', 'json'], help='Profile the parse (tracing off) and report as text or json')
 
     args = parser.parse_args()
 
@@ -188,19 +256,6 @@ def parse_arguments():
 
 
 if __name__ == '__main__':
-    rules = [
-        ('set',             'SET'),
-        ('\d+',             'NUMBER'),
-        ('[a-zA-Z_]\w*',    'IDENTIFIER'),
-        ('\+',              'PLUS'),
-        ('\-',              'MINUS'),
-        ('\*',              'MULTIPLY'),
-        ('\/',              'DIVIDE'),
-        ('\(',              'LP'),
-        ('\)',              'RP'),
-        ('=',               'EQUALS'),
-    ]
-
     args = parse_arguments()
     if args.verbose:
         level=logging.DEBUG
@@ -210,8 +265,12 @@ if __name__ == '__main__':
     FORMAT = "%(levelname)s[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s"
     logging.basicConfig(format=FORMAT, level=level)
 
-    cp = CalcParser(rules)
+    cp = CalcParser(RULES)
+    if args.profile:
+        cp.set_trace(False)
+        prof = profiling.Profiler(cp).attach()
     #cp.parse("set x = 10+4*7")
     #cp.parse("x*8+7")
     cp.parse(args.input)
-
+    if args.profile:
+        print(prof.format(args.profile), file=sys.stderr)
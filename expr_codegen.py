@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Python code generation for compiled expressions (see expr_ast).
+# A tree is turned into the source of one flat function, which is compiled
+# with compile() so that evaluating it runs no tree walking at all:
+#   x*8 + (x+1)^2 - y   ->   def evaluate(s0, s1):
+#                                t0 = s0 * 8
+#                                t1 = s0 + 1
+#                                t2 = power(t1, 2)
+#                                t3 = t0 + (t2 - s1)
+#                                return t3
+# Every identifier gets a fixed slot, an argument of the function, when the
+# code is generated, so no dict is looked up per operation; each operation
+# becomes one statement on local variables (three-address code), which
+# also keeps deep trees from nesting in the source. ^ calls expr_ast.power,
+# which refuses powers too big to compute. Shared nodes (see
+# expr_optimize) are computed into a variable once and used from there.
+# The bindings are all looked up before the function runs, so an unbound
+# identifier is reported (EvalError) ahead of any arithmetic error.
+#
+# Usage:
+#   c = generate(cp.compile("x*8+7"))
+#   c.evaluate({"x": 2})        -> 23
+#   c(2)                        -> 23 (the values in c.slots order)
+from expr_ast import Num, Var, BinOp, Sum, Expression, EvalError, power
+from expr_optimize import Shared
+
+# Python operators of the grammar's operators
+PY_OPERATORS = {
+    '+': '+',
+    '-': '-',
+    '*': '*',
+    '/': '/',
+}
+
+
+class CodeGenerator(object):
+    """ Generates the statements of one function from a tree.
+
+        slots:
+            The identifiers, in the order of the function's
+            arguments.
+
+        constants:
+            The values of the non-integer literals, which are passed
+            as default arguments (c0, c1, ...) rather than written
+            in the source.
+    """
+    def __init__(self):
+        self.slots = []
+        self.slot_names = {}
+        self.constants = []
+        self.lines = []
+        self.temps = 0
+        # variables already holding a node's value (Shared nodes)
+        self.done = {}
+
+    def temp(self, prefix="t"):
+        name = "%s%d" % (prefix, self.temps)
+        self.temps += 1
+        return name
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    #the source text of the operand holding a node's value, emitting
+    #the statements that compute it
+    def operand(self, node):
+        if isinstance(node, Num):
+            if type(node.value) is int:
+                # folding (see expr_optimize) makes negative literals,
+                # which are written as one operand: s0 - (-3)
+                if node.value < 0:
+                    return "(%r)" % node.value
+                return repr(node.value)
+            self.constants.append(node.value)
+            return "c%d" % (len(self.constants) - 1)
+
+        if isinstance(node, Var):
+            slot = self.slot_names.get(node.name)
+            if slot is None:
+                slot = self.slot_names[node.name] = "s%d" % len(self.slots)
+                self.slots.append(node.name)
+            return slot
+
+        if isinstance(node, Shared):
+            name = self.done.get(id(node))
+            if name is None:
+                name = self.done[id(node)] = self.operand(node.node)
+            return name
+
+        if isinstance(node, BinOp):
+            left = self.operand(node.left)
+            right = self.operand(node.right)
+            name = self.temp()
+            if node.op == '^':
+                self.emit("%s = power(%s, %s)" % (name, left, right))
+            else:
+                self.emit("%s = %s %s %s" % (name, left, PY_OPERATORS[node.op], right))
+            return name
+
+        if isinstance(node, Sum):
+            # the additions of Sum.evaluate, first + (0 + t1 - t2 ...),
+            # in the same order; the leading 0 only ever changes the
+            # sign of a zero
+            first = self.operand(node.first)
+            terms = [(op, self.operand(term)) for op, term in node.terms]
+            name = self.temp()
+            if len(terms) == 1:
+                op, operand = terms[0]
+                self.emit("%s = %s %s %s" % (name, first, op, operand))
+                return name
+            op, operand = terms[0]
+            total = operand if op == '+' else "-" + operand
+            for op, operand in terms[1:]:
+                total = "%s %s %s" % (total, op, operand)
+            self.emit("%s = %s + (%s)" % (name, first, total))
+            return name
+
+        raise TypeError("Can't generate code for %r" % (node,))
+
+    def source(self, tree):
+        """ The source of the function evaluating tree.
+        """
+        result = self.operand(tree)
+        self.emit("return %s" % result)
+        args = (["s%d" % i for i in range(len(self.slots))] +
+                ["c%d=c%d" % (i, i) for i in range(len(self.constants))])
+        return "def evaluate(%s):\n%s\n" % (", ".join(args), "\n".join(self.lines))
+
+
+class CompiledExpression(Expression):
+    """ A statement compiled to a Python function (see generate).
+
+        function:
+            The function; it takes the values of the identifiers
+            as arguments, in the order of slots.
+
+        source:
+            Its generated source.
+    """
+    def __init__(self, expression, function, slots, source):
+        Expression.__init__(self, expression.tree, expression.target, expression.text)
+        self.expression = expression
+        self.function = function
+        self.slots = tuple(slots)
+        self.source = source
+
+    def __call__(self, *values):
+        return self.function(*values)
+
+    def evaluate(self, bindings):
+        try:
+            values = [bindings[name] for name in self.slots]
+        except KeyError as err:
+            raise EvalError(err.args[0]) from None
+        return self.function(*values)
+
+    def evaluate_rows(self, rows):
+        """ The values for many bindings, each row a sequence of
+            values in the order of slots.
+        """
+        function = self.function
+        return [function(*row) for row in rows]
+
+    def execute(self, vars):
+        value = self.evaluate(vars)
+        if self.target is not None:
+            vars[self.target] = int(value)
+        return value
+
+
+#compile a statement (an Expression, optimized or not) to a Python function
+def generate(expression):
+    if isinstance(expression, CompiledExpression):
+        return expression
+    generator = CodeGenerator()
+    source = generator.source(expression.tree)
+    namespace = dict(("c%d" % i, value) for i, value in enumerate(generator.constants))
+    namespace["power"] = power
+    code = compile(source, "<expression %s>" % (expression.text or expression.tree,), "exec")
+    exec(code, namespace)
+    return CompiledExpression(expression, namespace["evaluate"], generator.slots, source)
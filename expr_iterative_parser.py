@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# An iterative engine for the grammar of expr_ebnf_parser:
+# start : expr | set ID = expr
+# expr : term ( + term | - term )*
+# term : power ( * power | / power)*
+# power: factor ^ power
+# factor : ID | '(' expr ')' | NUM
+#
+# The recursive descent parser uses a Python frame for every production it
+# is in, so long ^ chains and deeply parenthesized formulas hit the
+# recursion limit. Here expr() keeps the productions it is in on an explicit
+# stack of frames instead, and consumes the tokens in exactly the same order
+# as the recursive productions: it builds the same trees (Sum, BinOp, ...)
+# and reports the same parse errors at the same positions. Compiled
+# statements, optimized ones included, are evaluated with an explicit stack
+# as well. Optimizing and code generation (expr_optimize, expr_codegen)
+# still recurse on the tree, and generated code doesn't walk a tree at all.
+
+import argparse
+import logging
+
+import expr_ebnf_parser
+from expr_ast import Num, Var, BinOp, Sum, Expression, EvalError
+from expr_ebnf_parser import RULES
+from expr_optimize import Shared, Scope, OptimizedExpression
+
+# The frames of the productions expr() is in
+EXPR, TERM, POWER, PAREN = range(4)
+
+
+#the value of a tree, walked in the order of Node.evaluate with a stack of
+#pending nodes and one of computed values; the values of Shared nodes are
+#kept in the memo of env (a Scope)
+def evaluate_tree(tree, env):
+    values = []
+    stack = [(tree, False)]
+    while stack:
+        node, ready = stack.pop()
+        cls = type(node)
+        if cls is Num:
+            values.append(node.value)
+        elif cls is Var:
+            try:
+                values.append(env[node.name])
+            except KeyError:
+                raise EvalError(node.name) from None
+        elif cls is Shared:
+            memo = env.memo
+            if ready:
+                memo[node] = values[-1]
+            elif node in memo:
+                values.append(memo[node])
+            else:
+                stack.append((node, True))
+                stack.append((node.node, False))
+        elif cls is not BinOp and cls is not Sum:
+            values.append(node.evaluate(env))
+        elif not ready:
+            # evaluate the operands (left to right) first
+            stack.append((node, True))
+            operands = node.operands()
+            for i in range(len(operands) - 1, -1, -1):
+                stack.append((operands[i], False))
+        elif cls is BinOp:
+            right = values.pop()
+            values.append(node.fn(values.pop(), right))
+        else:
+            count = len(node.terms)
+            terms = values[-count:]
+            del values[-count:]
+            rest = 0
+            for (op, term), value in zip(node.terms, terms):
+                if op == '-':
+                    value = -value
+                rest = rest + value
+            values.append(values.pop() + rest)
+    return values[0]
+
+
+class IterativeOptimizedExpression(OptimizedExpression):
+    """ An optimized statement (see expr_optimize.optimize) whose
+        tree is evaluated without recursion.
+    """
+    def evaluate(self, bindings):
+        if self.shared:
+            bindings = Scope(bindings)
+        return evaluate_tree(self.tree, bindings)
+
+
+class IterativeExpression(Expression):
+    """ A compiled statement whose tree is evaluated without
+        recursion (see evaluate_tree).
+    """
+    optimized_class = IterativeOptimizedExpression
+
+    def evaluate(self, bindings):
+        return evaluate_tree(self.tree, bindings)
+
+    def execute(self, vars):
+        value = evaluate_tree(self.tree, vars)
+        if self.target is not None:
+            vars[self.target] = int(value)
+        return value
+
+
+# The parser of expr_ebnf_parser with an iterative expr(); statements,
+# compiling, caching and the options are all inherited
+class CalcParser(expr_ebnf_parser.CalcParser):
+
+    # the productions that are still methods of their own
+    productions = ("start", "statement", "expr")
+
+    expression_class = IterativeExpression
+
+    #take the next token (as match() does)
+    def advance(self):
+        self.cur_token = self.next_token
+        self.next_token = self.lx.token()
+
+    #the kind of the next token, None at the end of the input
+    def peek(self):
+        tok = self.next_token
+        return tok.kind if tok is not None else None
+
+    def expr(self):
+        NUMBER, IDENTIFIER, LP, RP = self.NUMBER, self.IDENTIFIER, self.LP, self.RP
+        PLUS, MINUS, MULTIPLY, DIVIDE = self.PLUS, self.MINUS, self.MULTIPLY, self.DIVIDE
+        POWER_KIND = self.POWER
+        peek, advance = self.peek, self.advance
+
+        # frames: [EXPR, first, terms, op], [TERM, lhs, op],
+        # [POWER, base] and [PAREN]
+        stack = [[EXPR, None, [], None], [TERM, None, None]]
+        while True:
+            #factor : ID | '(' expr ')' | NUM
+            kind = peek()
+            if kind == NUMBER:
+                advance()
+                value = Num(self.get_number())
+            elif kind == IDENTIFIER:
+                advance()
+                value = Var(self.cur_token.val)
+            elif kind == LP:
+                advance()
+                stack.append([PAREN])
+                stack.append([EXPR, None, [], None])
+                stack.append([TERM, None, None])
+                continue
+            else:
+                raise self.error()
+
+            while True:
+                #power: factor ^ power
+                if peek() == POWER_KIND:
+                    advance()
+                    stack.append([POWER, value])
+                    break
+                while stack[-1][0] == POWER:
+                    value = BinOp('^', stack.pop()[1], value)
+
+                #term : power ( * power | / power)*
+                frame = stack[-1]
+                if frame[1] is None:
+                    frame[1] = value
+                else:
+                    frame[1] = BinOp(frame[2], frame[1], value)
+                kind = peek()
+                if kind == MULTIPLY or kind == DIVIDE:
+                    advance()
+                    frame[2] = '*' if kind == MULTIPLY else '/'
+                    break
+                value = stack.pop()[1]
+
+                #expr : term ( + term | - term )*
+                frame = stack[-1]
+                if frame[1] is None:
+                    frame[1] = value
+                else:
+                    frame[2].append((frame[3], value))
+                kind = peek()
+                if kind == PLUS or kind == MINUS:
+                    advance()
+                    frame[3] = '+' if kind == PLUS else '-'
+                    stack.append([TERM, None, None])
+                    break
+                stack.pop()
+                value = Sum(frame[1], frame[2]) if frame[2] else frame[1]
+
+                if not stack:
+                    return value
+                #'(' expr ')' is a factor
+                stack.pop()
+                if peek() != RP:
+                    raise self.error()
+                advance()
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    parser = argparse.ArgumentParser(description="Iterative CalcParser arguments")
+
+    parser.add_argument('--input', dest='input', action='store', default="5+6", type=str, help='Specify input to parser')
+    parser.add_argument("-v", "--verbose", help="increase output verbosity(debug)",
+                                action="store_true")
+
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.verbose:
+        level=logging.DEBUG
+    else:
+        level=logging.INFO
+
+    FORMAT = "%(levelname)s[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s"
+    logging.basicConfig(format=FORMAT, level=level)
+
+    cp = CalcParser(RULES)
+    cp.parse("set x = 10+4*7")
+    cp.parse(args.input)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# Optimization of compiled expressions (see expr_ast), so that evaluating
+# them does the least work per binding:
+#   folding:      constant subtrees are computed once, e.g. (4*7)+x -> 28+x
+#                 and 2^3^2 -> 512
+#   identities:   x*1, 1*x, x^1, x+0, x-0, 0+x and zero terms of a sum go
+#   sharing:      repeated subexpressions are computed once per evaluation
+#                 (common subexpression elimination)
+# Every rewrite keeps the value exactly: nothing is reordered that would
+# round differently in floats, only integer constants are dropped by the
+# identities (x*1.0 is a float even if x is not), and operations that
+# raise (e.g. a division by zero) are left for the evaluation to raise.
+#
+# Usage:
+#   e = optimize(CalcParser(RULES).compile("(4*7)+x"))
+#   compare(cp.compile("x*y+x*y"), {"x": 2, "y": 3})  -> (12, 12)
+import math
+
+from expr_ast import Node, Num, Var, BinOp, Sum, Expression, OPERATORS
+
+# Integer powers are only folded if the result has at most this many bits;
+# bigger ones are left to the evaluation rather than slowing the compile
+MAX_FOLD_BITS = 4096
+
+
+class Shared(Node):
+    """ A subexpression used more than once in a tree. Its value is
+        computed once per evaluation and kept in the scope's memo.
+    """
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def evaluate(self, env):
+        memo = env.memo
+        try:
+            return memo[self]
+        except KeyError:
+            value = memo[self] = self.node.evaluate(env)
+            return value
+
+    def operands(self):
+        return (self.node,)
+
+    def __reduce__(self):
+        return (Shared, (self.node,))
+
+    def __repr__(self):
+        return "Shared(%r)" % (self.node,)
+
+    def __str__(self):
+        return str(self.node)
+
+
+class Scope(object):
+    """ The bindings of one evaluation of a tree with Shared nodes,
+        and the values of the nodes computed so far (memo).
+    """
+    __slots__ = ("bindings", "memo")
+
+    def __init__(self, bindings):
+        self.bindings = bindings
+        self.memo = {}
+
+    def __getitem__(self, name):
+        return self.bindings[name]
+
+
+class OptimizedExpression(Expression):
+    """ An optimized statement (see optimize). Trees with shared
+        subexpressions are evaluated in a fresh Scope every time.
+
+        original:
+            The statement before optimization.
+    """
+    def __init__(self, tree, original, shared):
+        Expression.__init__(self, tree, original.target, original.text)
+        self.original = original
+        self.shared = shared
+
+    def evaluate(self, bindings):
+        if self.shared:
+            bindings = Scope(bindings)
+        return self.tree.evaluate(bindings)
+
+    def execute(self, vars):
+        value = self.evaluate(vars)
+        if self.target is not None:
+            vars[self.target] = int(value)
+        return value
+
+
+#is node the integer literal value?
+def is_int(node, value):
+    return isinstance(node, Num) and type(node.value) is int and node.value == value
+
+
+#a ** b, refusing integer powers too big to compute at compile time
+def fold_pow(a, b):
+    if (isinstance(a, int) and isinstance(b, int) and b > 0 and abs(a) > 1 and
+            b * abs(a).bit_length() > MAX_FOLD_BITS):
+        raise OverflowError("power too big to fold")
+    return a ** b
+
+
+#the value of an operation on two constants, None if it raises
+def fold_op(op, a, b):
+    try:
+        if op == '^':
+            return fold_pow(a, b)
+        return OPERATORS[op](a, b)
+    except (ArithmeticError, ValueError):
+        return None
+
+
+#fold constants and drop identities, bottom up
+def simplify(node):
+    if isinstance(node, BinOp):
+        left = simplify(node.left)
+        right = simplify(node.right)
+        op = node.op
+        if isinstance(left, Num) and isinstance(right, Num):
+            value = fold_op(op, left.value, right.value)
+            if value is not None:
+                return Num(value)
+        if op in '+-' and is_int(right, 0):
+            return left
+        if op == '+' and is_int(left, 0):
+            return right
+        if op == '*' and is_int(right, 1):
+            return left
+        if op == '*' and is_int(left, 1):
+            return right
+        if op == '^' and is_int(right, 1):
+            return left
+        return BinOp(op, left, right)
+
+    if isinstance(node, Sum):
+        first = simplify(node.first)
+        terms = [(op, simplify(term)) for op, term in node.terms]
+        # the running total starts at 0 and is never -0.0, so integer
+        # zeros add nothing; constants at its start can be added up
+        # in the same order right away
+        terms = [(op, term) for op, term in terms if not is_int(term, 0)]
+        total = 0
+        constants = 0
+        for op, term in terms:
+            if not isinstance(term, Num):
+                break
+            value = fold_op('+', total, -term.value if op == '-' else term.value)
+            if value is None:
+                break
+            total = value
+            constants += 1
+        if constants:
+            terms = terms[constants:]
+            if not (type(total) is int and total == 0):
+                terms.insert(0, ('+', Num(total)))
+        if not terms:
+            return first
+        if isinstance(first, Num) and len(terms) == 1 and isinstance(terms[0][1], Num):
+            value = fold_op('+', first.value, terms[0][1].value)
+            if value is not None:
+                return Num(value)
+        return Sum(first, terms)
+
+    return node
+
+
+#the structural key of a node whose children are already interned
+def node_key(node):
+    if isinstance(node, Num):
+        return ('num', type(node.value), node.value)
+    if isinstance(node, Var):
+        return ('var', node.name)
+    if isinstance(node, BinOp):
+        return ('op', node.op, id(node.left), id(node.right))
+    if isinstance(node, Sum):
+        return ('sum', id(node.first), tuple((op, id(term)) for op, term in node.terms))
+    raise TypeError("Can't optimize %r" % (node,))
+
+
+#hash-cons a tree: equal subtrees become one node (a DAG)
+def intern(node, table):
+    if isinstance(node, BinOp):
+        node = BinOp(node.op, intern(node.left, table), intern(node.right, table))
+    elif isinstance(node, Sum):
+        node = Sum(intern(node.first, table),
+                [(op, intern(term, table)) for op, term in node.terms])
+    # NaN literals would never be equal to themselves as keys
+    if isinstance(node, Num) and isinstance(node.value, float) and math.isnan(node.value):
+        return node
+    return table.setdefault(node_key(node), node)
+
+
+#number of references to every node of a DAG (by id)
+def count_uses(node, uses):
+    uses[id(node)] = uses.get(id(node), 0) + 1
+    if uses[id(node)] == 1:
+        for child in node.operands():
+            count_uses(child, uses)
+
+
+#rebuild a DAG as a tree whose repeated operations are Shared nodes;
+#every reference to one of them gets the same Shared instance
+def share(node, uses, done):
+    key = id(node)
+    if key in done:
+        return done[key]
+    if isinstance(node, BinOp):
+        result = BinOp(node.op, share(node.left, uses, done), share(node.right, uses, done))
+    elif isinstance(node, Sum):
+        result = Sum(share(node.first, uses, done),
+                [(op, share(term, uses, done)) for op, term in node.terms])
+    else:
+        # literals and identifiers are cheaper than the memo
+        result = node
+    if result is not node and uses[key] > 1:
+        result = Shared(result)
+    done[key] = result
+    return result
+
+
+#number of operations evaluated for a tree (a Shared one once)
+def count_ops(node, seen=None):
+    if seen is None:
+        seen = set()
+    if isinstance(node, Shared):
+        if id(node) in seen:
+            return 0
+        seen.add(id(node))
+        return count_ops(node.node, seen)
+    if isinstance(node, BinOp):
+        return 1 + count_ops(node.left, seen) + count_ops(node.right, seen)
+    if isinstance(node, Sum):
+        return len(node.terms) + count_ops(node.first, seen) + sum(
+                count_ops(term, seen) for op, term in node.terms)
+    return 0
+
+
+#optimize a compiled statement (an Expression); the result evaluates to
+#the same values. An Expression class may name the class of its optimized
+#statements (optimized_class), e.g. to keep its own way of evaluating.
+def optimize(expression):
+    if isinstance(expression, OptimizedExpression):
+        return expression
+    tree = intern(simplify(expression.tree), {})
+    uses = {}
+    count_uses(tree, uses)
+    tree = share(tree, uses, {})
+    cls = getattr(expression, "optimized_class", OptimizedExpression)
+    return cls(tree, expression, has_shared(tree))
+
+
+#does a tree have Shared nodes?
+def has_shared(node):
+    if isinstance(node, Shared):
+        return True
+    return any(has_shared(child) for child in node.operands())
+
+
+#the values of a statement without and with optimization, for checking
+#one against the other
+def compare(expression, bindings):
+    if isinstance(expression, OptimizedExpression):
+        expression = expression.original
+    return expression.evaluate(bindings), optimize(expression).evaluate(bindings)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# Incremental recalculation of `set` formulas.
+# A RecalcSession keeps every `set x = expr` statement it is given as a live
+# formula, and a graph of which formulas use which identifiers. When a
+# formula (or an input value) changes, only the formulas that depend on it,
+# directly or through others, are evaluated again, each one after the ones
+# it uses (in topological order); a formula whose value comes out the same
+# stops the change from spreading further. A formula that would depend on
+# itself is refused with a CycleError.
+#
+# Usage:
+#   s = RecalcSession()
+#   s.execute("set total = price * count")
+#   s.execute("set price = 7")
+#   s.update({"count": 3})        -> ['total'] (the formulas recomputed)
+#   s.vars["total"]               -> 21
+import argparse
+import sys
+
+import expr_ebnf_parser
+from expr_ast import EvalError
+from expr_batch import error_message
+from lexer import LexerError
+from parser import ParseError
+
+
+class CycleError(Exception):
+    """ A formula that would depend on itself.
+
+        cycle:
+            The names around the cycle, each one used by the next
+            (the first and last are the same).
+    """
+    def __init__(self, cycle):
+        Exception.__init__(self, "Cycle %s" % " -> ".join(cycle))
+        self.cycle = cycle
+
+
+class RecalcSession(object):
+    """ Live `set` formulas and their values.
+
+        vars:
+            The values of the formulas and inputs, as the parsers keep
+            them (a set stores int(value)). A formula that fails to
+            evaluate has no value; its error message is in errors.
+
+        formulas:
+            The compiled set statements (Expressions) by their target.
+
+        dependents:
+            For every identifier, the names of the formulas using it.
+    """
+    def __init__(self, parser=None):
+        if parser is None:
+            parser = expr_ebnf_parser.CalcParser(expr_ebnf_parser.RULES, trace=False)
+        self.parser = parser
+        self.vars = {}
+        self.errors = {}
+        self.formulas = {}
+        self.dependents = {}
+
+    def execute(self, text):
+        """ Run a statement: a set statement defines (or replaces)
+            a formula and returns the names recomputed, in order; an
+            expression is evaluated against the current values and
+            returns its value. Raises ParseError, and CycleError or
+            the evaluation's errors as Expression.execute does.
+        """
+        expression = self.parser.compile(text)
+        if expression.target is None:
+            return expression.evaluate(self.vars)
+        return self.define(expression)
+
+    def define(self, expression):
+        """ Make a compiled set statement the formula of its target,
+            and recompute it and its dependents. Returns the names
+            recomputed.
+        """
+        name = expression.target
+        cycle = self.find_cycle(name, expression.names)
+        if cycle:
+            raise CycleError(cycle)
+        self.unlink(name)
+        self.formulas[name] = expression
+        for used in expression.names:
+            self.dependents.setdefault(used, set()).add(name)
+        return self.recalculate([name], force=True)
+
+    def update(self, values):
+        """ Set input values (a mapping of names to numbers), which
+            replace any formulas of those names, and recompute what
+            depends on them. Returns the names recomputed.
+        """
+        changed = []
+        for name, value in values.items():
+            self.unlink(name)
+            self.formulas.pop(name, None)
+            self.errors.pop(name, None)
+            if name not in self.vars or not same(self.vars[name], value):
+                self.vars[name] = value
+                changed.append(name)
+        return self.recalculate(changed)
+
+    def remove(self, name):
+        """ Drop a formula or input; the formulas using it are
+            recomputed (and fail until it is set again).
+        """
+        self.unlink(name)
+        self.formulas.pop(name, None)
+        self.errors.pop(name, None)
+        if name not in self.vars:
+            return []
+        del self.vars[name]
+        return self.recalculate([name])
+
+    #forget the identifiers used by name's formula
+    def unlink(self, name):
+        expression = self.formulas.get(name)
+        if expression is None:
+            return
+        for used in expression.names:
+            users = self.dependents.get(used)
+            if users is not None:
+                users.discard(name)
+                if not users:
+                    del self.dependents[used]
+
+    #the cycle a formula for name using names would close, if any:
+    #a path from name through its dependents to one of names
+    def find_cycle(self, name, names):
+        if name in names:
+            return [name, name]
+        parent = {name: None}
+        stack = [name]
+        while stack:
+            node = stack.pop()
+            for user in self.dependents.get(node, ()):
+                if user in parent:
+                    continue
+                parent[user] = node
+                if user in names:
+                    cycle = [user]
+                    while cycle[-1] != name:
+                        cycle.append(parent[cycle[-1]])
+                    cycle.reverse()
+                    return cycle + [name]
+                stack.append(user)
+        return None
+
+    #the formulas depending on any of names (and those in formulas
+    #themselves), each after the formulas it uses
+    def affected(self, names):
+        order = []
+        seen = set()
+        for root in names:
+            if root in seen:
+                continue
+            seen.add(root)
+            # depth first; a name is added after all its dependents
+            stack = [(root, iter(self.dependents.get(root, ())))]
+            while stack:
+                node, users = stack[-1]
+                for user in users:
+                    if user not in seen:
+                        seen.add(user)
+                        stack.append((user, iter(self.dependents.get(user, ()))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        order.reverse()
+        return [name for name in order if name in self.formulas]
+
+    #evaluate the formulas affected by a change of the names changed,
+    #skipping those none of whose identifiers changed value; with force
+    #the changed names are formulas that are evaluated regardless
+    def recalculate(self, changed, force=False):
+        changed = set(changed)
+        forced = changed if force else ()
+        recomputed = []
+        for name in self.affected(changed):
+            expression = self.formulas[name]
+            if name not in forced and changed.isdisjoint(expression.names):
+                continue
+            recomputed.append(name)
+            old = self.vars.get(name)
+            had_value = name in self.vars
+            try:
+                value = int(expression.evaluate(self.vars))
+            except (EvalError, ArithmeticError, ValueError, TypeError, RecursionError) as err:
+                self.errors[name] = error_message(err)
+                self.vars.pop(name, None)
+                if had_value:
+                    changed.add(name)
+                continue
+            self.errors.pop(name, None)
+            self.vars[name] = value
+            if not had_value or not same(old, value):
+                changed.add(name)
+        return recomputed
+
+
+#are two values the same (2 and 2.0 are not)?
+def same(a, b):
+    return type(a) is type(b) and a == b
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Recalculation session arguments")
+    arg_parser.add_argument('--file', dest='file', action='store', default="-", type=str,
+            help='File of statements, one per line (default: stdin)')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    session = RecalcSession()
+    source = sys.stdin if args.file == "-" else open(args.file)
+    failed = 0
+    for number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            result = session.execute(line)
+        except (ParseError, LexerError, CycleError, EvalError, ArithmeticError,
+                RecursionError) as err:
+            failed += 1
+            print("%d: error: %s" % (number, error_message(err)))
+            continue
+        if not isinstance(result, list):
+            print("%d: %s" % (number, result))
+            continue
+        for name in result:
+            if name in session.vars:
+                print("%d: %s = %s" % (number, name, session.vars[name]))
+            else:
+                print("%d: %s: %s" % (number, name, session.errors[name]))
+    sys.exit(1 if failed else 0)
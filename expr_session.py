@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Script mode for the calculator: a stream of statements, one per line,
+# run through one long-lived parser (and its lexer and compile cache), with
+# the variables of the `set` statements kept from one statement to the
+# next. Every statement gets one line of JSON as soon as it has run, with
+# its value or its error and the time it took:
+#   {"line": 1, "input": "set x = 2", "target": "x", "value": 2, "time_us": 41.2}
+#   {"line": 2, "input": "x/0", "error": "ZeroDivisionError: division by zero", "time_us": 9.8}
+# Errors don't stop the script. Blank lines and lines starting with # are
+# skipped. Values that JSON can't hold (inf, nan, complex numbers) are given
+# as strings; an integer too long to write out is an error.
+#
+# Usage:
+#   python expr_session.py --file script.txt > results.jsonl
+#   for record in run_session(open("script.txt")): ...
+import argparse
+import json
+import math
+import sys
+import time
+
+import expr_optimize
+from expr_batch import GRAMMARS, error_message, run_statement
+from lexer import LexerError
+from parser import ParseError
+
+
+#a new parser of the grammar, for a session
+def session_parser(grammar='ebnf'):
+    if grammar not in GRAMMARS:
+        raise ValueError("Unknown grammar %s" % grammar)
+    module = GRAMMARS[grammar]
+    return module.CalcParser(module.RULES, trace=False)
+
+
+# Integers longer than this are checked against Python's limit on the
+# digits of an int turned into text
+JSON_INT_BITS = 10000
+
+
+#a value as JSON can hold it; raises ValueError for an int too long to
+#write out (see sys.set_int_max_str_digits)
+def json_value(value):
+    if isinstance(value, complex):
+        return repr(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        return repr(value)
+    if isinstance(value, int) and value.bit_length() > JSON_INT_BITS:
+        str(value)
+    return value
+
+
+#run the statements of lines (e.g. a file) through one parser; yields a
+#record (a dict) per statement as it completes. vars (default: the
+#parser's own) holds the variables.
+def run_session(lines, parser=None, vars=None, optimize=False):
+    if parser is None:
+        parser = session_parser()
+    if vars is None:
+        vars = parser.vars
+    for number, text in enumerate(lines, 1):
+        text = text.strip()
+        if not text or text.startswith('#'):
+            continue
+        t0 = time.perf_counter()
+        try:
+            compiled = parser.compile(text)
+            if optimize:
+                compiled = expr_optimize.optimize(compiled)
+        except (ParseError, LexerError, RecursionError) as err:
+            compiled = error_message(err)
+        result = run_statement(number - 1, text, compiled, vars)
+        error = result.error
+        if result.ok:
+            try:
+                value = json_value(result.value)
+            except ValueError as err:
+                error = error_message(err)
+        elapsed = time.perf_counter() - t0
+
+        record = {"line": number, "input": text}
+        if error is None:
+            if compiled.target is not None:
+                record["target"] = compiled.target
+            record["value"] = value
+        else:
+            record["error"] = error
+        record["time_us"] = round(elapsed * 1e6, 1)
+        yield record
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Calculator session arguments")
+    arg_parser.add_argument('--file', dest='file', action='store', default="-", type=str,
+            help='Script of statements, one per line (default: stdin)')
+    arg_parser.add_argument('--grammar', dest='grammar', action='store', default='ebnf',
+            choices=sorted(GRAMMARS), help='Grammar of the statements')
+    arg_parser.add_argument('--optimize', help="optimize the compiled statements (see expr_optimize)",
+            action="store_true")
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    parser = session_parser(args.grammar)
+    # from stdin, every result is written out right away (e.g. for a
+    # program feeding statements one at a time)
+    interactive = args.file == "-"
+    source = sys.stdin if interactive else open(args.file)
+    count = failed = 0
+    t0 = time.perf_counter()
+    for record in run_session(source, parser, optimize=args.optimize):
+        count += 1
+        failed += "error" in record
+        print(json.dumps(record), flush=interactive)
+    elapsed = time.perf_counter() - t0
+    print("%d statements, %d failed, in %.3f s" % (count, failed, elapsed), file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Vectorized evaluation of compiled expressions (see expr_ast) over NumPy
+# arrays. Every identifier is bound to a whole array and the expression
+# tree is walked once, each node applying a NumPy operation to all the rows:
+#   + - * /  ->  numpy.add, subtract, multiply, true_divide
+#   ^        ->  numpy.power (in floats when an integer array would be
+#                raised to a negative power, as Python's ** does)
+# Scalars and arrays of different shapes are broadcast as in NumPy. Unlike
+# the scalar evaluation, integers are fixed-width (int64 wraps around) and
+# a division by zero gives inf/nan instead of raising.
+#
+# Usage:
+#   x = numpy.arange(1000000)
+#   evaluate_arrays("x*8+7", {"x": x})
+#
+# NumPy is an optional dependency; only this module needs it.
+import argparse
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import expr_ebnf_parser
+from expr_ast import Num, Var, BinOp, Sum, EvalError
+from expr_optimize import Shared
+
+# parser for the expressions given as text, created on first use
+vector_parser = None
+
+
+def need_numpy():
+    if numpy is None:
+        raise ImportError("vectorized evaluation needs numpy")
+
+
+#a ** b elementwise; integers raised to negative powers give floats
+def power(a, b):
+    if (numpy.issubdtype(numpy.result_type(a), numpy.integer) and
+            numpy.issubdtype(numpy.result_type(b), numpy.integer) and
+            numpy.any(numpy.asarray(b) < 0)):
+        return numpy.power(a, b, dtype=numpy.float64)
+    return numpy.power(a, b)
+
+
+# The operators on arrays, by their token text
+VECTOR_OPERATORS = {
+    '+': lambda a, b: numpy.add(a, b),
+    '-': lambda a, b: numpy.subtract(a, b),
+    '*': lambda a, b: numpy.multiply(a, b),
+    '/': lambda a, b: numpy.true_divide(a, b),
+    '^': power,
+}
+
+
+#the value of a tree with the identifiers bound to arrays (env); memo
+#holds the values of its Shared nodes
+def evaluate_tree(node, env, memo=None):
+    if memo is None:
+        memo = {}
+    if isinstance(node, Num):
+        return node.value
+    if isinstance(node, Var):
+        try:
+            return env[node.name]
+        except KeyError:
+            raise EvalError(node.name) from None
+    if isinstance(node, BinOp):
+        return VECTOR_OPERATORS[node.op](evaluate_tree(node.left, env, memo),
+                evaluate_tree(node.right, env, memo))
+    if isinstance(node, Sum):
+        first = evaluate_tree(node.first, env, memo)
+        rest = 0
+        for op, term in node.terms:
+            value = evaluate_tree(term, env, memo)
+            if op == '-':
+                value = numpy.negative(value)
+            rest = numpy.add(rest, value)
+        return numpy.add(first, rest)
+    if isinstance(node, Shared):
+        if node not in memo:
+            memo[node] = evaluate_tree(node.node, env, memo)
+        return memo[node]
+    raise TypeError("Can't evaluate %r" % (node,))
+
+
+#compile an expression given as text with the EBNF grammar
+def compile_text(text):
+    global vector_parser
+    if vector_parser is None:
+        vector_parser = expr_ebnf_parser.CalcParser(expr_ebnf_parser.RULES, trace=False)
+    return vector_parser.compile(text)
+
+
+#evaluate an expression (text or a compiled Expression) elementwise with
+#its identifiers bound to the arrays (or scalars) of bindings; the result
+#is an array of the bindings' broadcast shape
+def evaluate_arrays(expression, bindings):
+    need_numpy()
+    if isinstance(expression, str):
+        expression = compile_text(expression)
+    env = {}
+    for name in expression.names:
+        try:
+            env[name] = numpy.asarray(bindings[name])
+        except KeyError:
+            raise EvalError(name) from None
+    result = numpy.asarray(evaluate_tree(expression.tree, env))
+
+    # a result that doesn't depend on all the arrays (e.g. a constant)
+    # still gets a value per row
+    shape = numpy.broadcast_shapes(*[array.shape for array in env.values()])
+    if result.shape != shape:
+        result = numpy.broadcast_to(result, shape).copy()
+    return result
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Vectorized evaluation arguments")
+    arg_parser.add_argument('--input', dest='input', action='store', default="x*8+7", type=str,
+            help='Expression to evaluate')
+    arg_parser.add_argument('--file', dest='file', action='store', default=None, type=str,
+            help='CSV file with a header; identifiers are bound to its numeric columns')
+    arg_parser.add_argument('--rows', dest='rows', action='store', default=1000000, type=int,
+            help='Rows of random data per identifier (without --file)')
+    arg_parser.add_argument('--seed', dest='seed', action='store', default=0, type=int,
+            help='Seed of the random data')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    need_numpy()
+    expression = compile_text(args.input)
+    if args.file:
+        import csv_columns
+        with open(args.file) as f:
+            columns = csv_columns.parse_columns(f, header=True)
+        bindings = dict((name, columns.to_numpy(name))
+                for name, type in zip(columns.names, columns.types) if type != 'str')
+    else:
+        rng = numpy.random.default_rng(args.seed)
+        bindings = dict((name, rng.integers(1, 100, args.rows))
+                for name in expression.names)
+
+    t0 = time.perf_counter()
+    result = evaluate_arrays(expression, bindings)
+    elapsed = time.perf_counter() - t0
+    print(result)
+    print("%d rows in %.3f s (%.0f rows/s)" % (result.size, elapsed,
+            result.size / elapsed if elapsed else 0), file=sys.stderr)
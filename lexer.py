@@ -7,18 +7,48 @@
 # Last modified: March 2009
 #-----------------------------------------------
 #
+import json
 import re
 import sys
+from array import array
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from cache import LRUCache
+
+
+# Number of characters (or bytes) read at a time from a file object
+# given to Lexer.input_stream.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the contents of the file object f in chunks of at
+        most chunk_size characters (or bytes).
+    """
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
 
 
 class Token(object):
     """ A simple Token structure.
-        Contains the token type, value and position.
+        Contains the token type, value and position, and the
+        integer kind of the type (see Lexer.kinds).
     """
-    def __init__(self, type, val, pos):
+    __slots__ = ('type', 'val', 'pos', 'kind')
+
+    def __init__(self, type, val, pos, kind=None):
         self.type = type
         self.val = val
         self.pos = pos
+        self.kind = kind
 
     def __str__(self):
         return '%s(%s) at %s' % (self.type, self.val, self.pos)
@@ -34,52 +64,452 @@ class LexerError(Exception):
         self.pos = pos
 
 
-class Lexer(object):
-    """ A simple regex-based lexer/tokenizer.
+# The first-character index only covers ASCII; tokens starting with
+# any other character are matched with the full regex.
+INDEXED_CHARS = frozenset(chr(c) for c in range(128))
 
-        See below for an example of usage.
+CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: frozenset('0123456789'),
+    sre_constants.CATEGORY_SPACE: frozenset(' \t\n\r\f\v'),
+    sre_constants.CATEGORY_WORD: frozenset(
+        'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'),
+}
+
+
+def first_chars(regex):
+    """ Return the set of (ASCII) characters a match of regex can
+        start with, or None if that can't be narrowed down: the
+        regex may match the empty string, or uses constructs this
+        analysis does not follow.
     """
-    def __init__(self, rules, skip_whitespace=True):
-        """ Create a lexer.
+    try:
+        chars, nullable = _first_of(sre_parse.parse(regex).data)
+    except (re.error, _Unknown):
+        return None
+    if nullable:
+        return None
+    return chars & INDEXED_CHARS
 
-            rules:
-                A list of rules. Each rule is a `regex, type`
-                pair, where `regex` is the regular expression used
-                to recognize the token and `type` is the type
-                of the token to return when it's recognized.
 
-            skip_whitespace:
-                If True, whitespace (\s+) will be skipped and not
-                reported by the lexer. Otherwise, you have to
-                specify your rules for whitespace, or it will be
-                flagged as an error.
+class _Unknown(Exception):
+    pass
+
+
+def _first_of(items):
+    # first set and nullability of a sequence of regex items
+    chars = set()
+    for op, av in items:
+        item_chars, nullable = _first_item(op, av)
+        chars |= item_chars
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def _first_item(op, av):
+    if op is sre_constants.LITERAL:
+        return set([chr(av)]), False
+    if op is sre_constants.IN:
+        return _first_in(av), False
+    if op is sre_constants.SUBPATTERN:
+        group, add_flags, del_flags, items = av
+        if add_flags or del_flags:
+            raise _Unknown()
+        return _first_of(items)
+    if op is sre_constants.BRANCH:
+        chars, nullable = set(), False
+        for items in av[1]:
+            branch_chars, branch_nullable = _first_of(items)
+            chars |= branch_chars
+            nullable = nullable or branch_nullable
+        return chars, nullable
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, 'POSSESSIVE_REPEAT', None)):
+        low, high, items = av
+        chars, nullable = _first_of(items)
+        return chars, nullable or low == 0
+    if op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+        return _first_of(av)
+    if op is sre_constants.AT:
+        # anchors match no characters
+        return set(), True
+    raise _Unknown()
+
+
+def _first_in(items):
+    # characters of a [...] set
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_constants.RANGE:
+            low, high = av
+            chars.update(chr(c) for c in range(low, min(high, 127) + 1))
+        elif op is sre_constants.CATEGORY and av in CATEGORY_CHARS:
+            chars |= CATEGORY_CHARS[av]
+        else:
+            raise _Unknown()
+    if negate:
+        return set(INDEXED_CHARS - chars)
+    return chars
+
+
+class LexerTables(object):
+    """ The compiled form of a list of lexer rules: the combined
+        regex and the tables that map its groups back to token
+        types and kinds. It holds no input state, so a single
+        LexerTables is shared by every Lexer built from the same
+        rules (see compile_rules).
+    """
+    def __init__(self, rules, skip_whitespace=True, state=None):
+        """ rules, skip_whitespace:
+                As for Lexer.
+
+            state:
+                A dict from to_dict(). If given, the tables are
+                restored from it instead of being built from the
+                rules.
         """
+        self.rules = tuple(tuple(rule) for rule in rules)
+        self.skip_whitespace = skip_whitespace
+        if state is None:
+            state = self._build()
+
+        self.group_type = state['group_type']
+        self.group_kind = state['group_kind']
+        self.kind_names = state['kind_names']
+        self.kinds = dict((type, kind)
+                for kind, type in enumerate(self.kind_names))
+
+        self.regex = re.compile(state['pattern'])
+        if skip_whitespace is True:
+            self.re_ws_skip = re.compile(r'\s*')
+        else:
+            self.re_ws_skip = re.compile(skip_whitespace or '')
+        # (ASCII) characters the whitespace skip never moves past
+        self.solid = self._solid(self.re_ws_skip, INDEXED_CHARS)
+
+        # first-character index: the regexes to try for a token
+        # starting with a given character, and the characters that
+        # are a token by themselves (see _build_dispatch)
+        self.dispatch_rules = state['dispatch']
+        self.literal_rules = state['literals']
+        self.dispatch = self._dispatch_regexes(str)
+        self.literals = self._literal_groups(str)
+
+        # tokenize() runs this with finditer, letting the regex
+        # engine do the whitespace skipping as well
+        if skip_whitespace:
+            self.bulk_regex = re.compile('%s(?:%s)' %
+                    (self.re_ws_skip.pattern, self.regex.pattern))
+        else:
+            self.bulk_regex = self.regex
+
+        # bytes versions of the above, compiled the first time a
+        # bytes-like buffer is lexed
+        self.bytes = None
+
+    def _build(self):
         # All the regexes are concatenated into a single one
         # with named groups. Since the group names must be valid
         # Python identifiers, but the token types used by the
         # user are arbitrary strings, we auto-generate the group
         # names and map them to token types.
         #
+        # Each distinct token type also gets a small integer kind
+        # (in order of first appearance). Tokens carry it so that
+        # parsers can dispatch on ints instead of type strings.
+        #
         idx = 1
         regex_parts = []
-        self.group_type = {}
+        group_type = {}
+        group_kind = {}
+        kinds = {}
+        kind_names = []
 
-        for regex, type in rules:
+        for regex, type in self.rules:
             groupname = 'GROUP%s' % idx
             regex_parts.append('(?P<%s>%s)' % (groupname, regex))
-            self.group_type[groupname] = type
+            group_type[groupname] = type
+            if type not in kinds:
+                kinds[type] = len(kind_names)
+                kind_names.append(type)
+            group_kind[groupname] = kinds[type]
             idx += 1
 
-        self.regex = re.compile('|'.join(regex_parts))
         #print ("regex_parts is {}\n {} ".format(regex_parts, '|'.join(regex_parts)))
+        return {
+            'pattern': '|'.join(regex_parts),
+            'group_type': group_type,
+            'group_kind': group_kind,
+            'kind_names': kind_names,
+            'dispatch': self._build_dispatch(),
+            'literals': self._build_literals(),
+        }
+
+    def _build_dispatch(self):
+        # For every indexed character, the (indices of the) rules
+        # that can match a token starting with it, in rule order.
+        # Characters that every rule may start with are left out,
+        # as the full regex is no worse for them.
+        firsts = [first_chars(regex) for regex, type in self.rules]
+        dispatch = {}
+        for char in sorted(INDEXED_CHARS):
+            candidates = [idx for idx, chars in enumerate(firsts)
+                    if chars is None or char in chars]
+            if len(candidates) < len(self.rules):
+                dispatch[char] = candidates
+        return dispatch
+
+    def _build_literals(self):
+        # When the first rule that can match at a character is
+        # that very character (e.g. '\+'), it always wins: the
+        # token is known without running any regex.
+        firsts = [first_chars(regex) for regex, type in self.rules]
+        literals = {}
+        for char in sorted(INDEXED_CHARS):
+            for idx, chars in enumerate(firsts):
+                if chars is None or char in chars:
+                    if self._is_literal(self.rules[idx][0], char):
+                        literals[char] = idx
+                    break
+        return literals
+
+    def _is_literal(self, regex, char):
+        try:
+            items = sre_parse.parse(regex).data
+        except re.error:
+            return False
+        return list(items) == [(sre_constants.LITERAL, ord(char))]
+
+    def _literal_groups(self, kind):
+        return dict((char if kind is str else ord(char), 'GROUP%s' % (idx + 1))
+                for char, idx in self.literal_rules.items())
+
+    def _dispatch_regexes(self, kind):
+        # compile the index for str (or bytes) buffers, one regex
+        # per distinct set of candidate rules
+        compiled = {}
+        dispatch = {}
+        for char, candidates in self.dispatch_rules.items():
+            candidates = tuple(candidates)
+            if candidates not in compiled:
+                pattern = '|'.join('(?P<GROUP%s>%s)' %
+                        (idx + 1, self.rules[idx][0]) for idx in candidates)
+                never = '(?!)'
+                if kind is bytes:
+                    pattern = pattern.encode('latin-1')
+                    never = b'(?!)'
+                # a char no rule starts with can never match
+                compiled[candidates] = re.compile(pattern or never)
+            dispatch[char if kind is str else ord(char)] = compiled[candidates]
+        return dispatch
+
+    def _solid(self, re_ws_skip, chars):
+        return frozenset(c for c in chars if re_ws_skip.match(
+                c if isinstance(c, str) else bytes([c])).end() == 0)
+
+    def bytes_patterns(self):
+        """ The (regex, re_ws_skip, bulk_regex, dispatch, literals,
+            solid) tables for scanning bytes-like buffers.
+        """
+        if self.bytes is None:
+            re_ws_skip = self._to_bytes(self.re_ws_skip)
+            self.bytes = (
+                self._to_bytes(self.regex),
+                re_ws_skip,
+                self._to_bytes(self.bulk_regex),
+                self._dispatch_regexes(bytes),
+                self._literal_groups(bytes),
+                self._solid(re_ws_skip, range(256)))
+        return self.bytes
+
+    def _to_bytes(self, regex):
+        """ Recompile a str pattern so it can scan bytes-like buffers.
+        """
+        return re.compile(regex.pattern.encode('latin-1'),
+                regex.flags & ~re.UNICODE)
+
+    def to_dict(self):
+        """ A JSON-serializable form of the tables, which can be
+            passed back as the state of a new LexerTables.
+        """
+        return {
+            'rules': [list(rule) for rule in self.rules],
+            'skip_whitespace': self.skip_whitespace,
+            'pattern': self.regex.pattern,
+            'group_type': self.group_type,
+            'group_kind': self.group_kind,
+            'kind_names': self.kind_names,
+            'dispatch': self.dispatch_rules,
+            'literals': self.literal_rules,
+        }
+
+
+# Process-wide registry of compiled rules, keyed by the rules and the
+# whitespace flag. Parsers are often created per request; with this
+# they only pay for building and compiling the combined regex once.
+TABLES_CACHE_SIZE = 64
+tables_cache = LRUCache(TABLES_CACHE_SIZE)
+
+# Version of the file format written by save_tables.
+TABLES_FORMAT = 1
+
+
+def compile_rules(rules, skip_whitespace=True):
+    """ Return the LexerTables for the given rules, from the
+        registry if they were compiled before.
+    """
+    key = (tuple(tuple(rule) for rule in rules), skip_whitespace)
+    tables = tables_cache.get(key)
+    if tables is None:
+        tables = LexerTables(key[0], skip_whitespace)
+        tables_cache.put(key, tables)
+    return tables
+
+
+def save_tables(path):
+    """ Write every LexerTables in the registry to a JSON file
+        that load_tables can read back.
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'format': TABLES_FORMAT,
+            'tables': [tables.to_dict() for tables in tables_cache.values()],
+        }, f)
+
+
+def load_tables(path):
+    """ Fill the registry from a file written by save_tables,
+        e.g. at process startup, so lexers built later skip
+        assembling their tables from the rules.
+        Returns the number of LexerTables loaded.
+    """
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get('format') != TABLES_FORMAT:
+        raise ValueError("%s: unsupported lexer tables format %r" %
+                (path, saved.get('format')))
+
+    for state in saved['tables']:
+        tables = LexerTables(state['rules'], state['skip_whitespace'], state)
+        tables_cache.put((tables.rules, tables.skip_whitespace), tables)
+    return len(saved['tables'])
+
+
+class Lexer(object):
+    """ A simple regex-based lexer/tokenizer.
+
+        See below for an example of usage.
+    """
+    def __init__(self, rules, skip_whitespace=True, dispatch=True):
+        """ Create a lexer.
+
+            rules:
+                A list of rules. Each rule is a `regex, type`
+                pair, where `regex` is the regular expression used
+                to recognize the token and `type` is the type
+                of the token to return when it's recognized.
+
+            skip_whitespace:
+                If True, whitespace (\s+) will be skipped and not
+                reported by the lexer. It may also be a regex
+                of the whitespace to skip, e.g. r'[ \t]*' to
+                keep newlines as tokens. Otherwise, you have to
+                specify your rules for whitespace, or it will be
+                flagged as an error.
+
+            dispatch:
+                If True, the rules to try at each position are
+                looked up by the character found there, instead of
+                trying every rule of the combined regex in turn.
+                The tokens are the same either way.
+        """
+        # the compiled rules are shared (see compile_rules)
+        self.tables = compile_rules(rules, skip_whitespace)
+        self.group_type = self.tables.group_type
+        self.group_kind = self.tables.group_kind
+        self.kinds = self.tables.kinds
+        self.kind_names = self.tables.kind_names
+        self.regex = self.tables.regex
         self.skip_whitespace = skip_whitespace
-        self.re_ws_skip = re.compile('\S')
+        self.dispatch = dispatch
 
     def input(self, buf):
         """ Initialize the lexer with a buffer as input.
+
+            buf may be a str or any bytes-like object (bytes,
+            bytearray, memoryview, mmap). The buffer is scanned
+            in place at the current offset and is never copied.
+            Token values from a bytes-like buffer are bytes.
         """
         self.buf = buf
         self.pos = 0
+        self.end = len(buf)
+        # absolute offset of buf[0] and the source of further
+        # chunks; only a streamed input (see input_stream) has any
+        self.base = 0
+        self.chunks = None
+        if isinstance(buf, str):
+            self.cur_regex = self.tables.regex
+            self.cur_ws_skip = self.tables.re_ws_skip
+            self.cur_bulk_regex = self.tables.bulk_regex
+            self.cur_dispatch = self.tables.dispatch
+            self.cur_literals = self.tables.literals
+            self.cur_solid = self.tables.solid
+        else:
+            (self.cur_regex, self.cur_ws_skip, self.cur_bulk_regex,
+                    self.cur_dispatch, self.cur_literals,
+                    self.cur_solid) = self.tables.bytes_patterns()
+        if not self.dispatch:
+            self.cur_dispatch = None
+
+    def input_stream(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Initialize the lexer with a streamed input.
+
+            source:
+                A file object (text or binary), which is read
+                chunk_size characters at a time, or any iterator
+                of str/bytes chunks.
+
+            Only the unconsumed tail of the current chunk is kept
+            in memory. Tokens that cross a chunk boundary are
+            handled by refilling the buffer before a match that
+            touches its end is accepted. Token positions are
+            offsets from the start of the stream.
+        """
+        if hasattr(source, 'read'):
+            chunks = read_chunks(source, chunk_size)
+        else:
+            chunks = iter(source)
+
+        first = next(chunks, '')
+        self.input(first)
+        self.chunks = chunks
+
+    def refill(self):
+        """ Append the next chunk of a streamed input to the buffer,
+            dropping the part that was already consumed.
+            Returns False once the stream is exhausted (always,
+            if the input is not streamed).
+        """
+        if self.chunks is None:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                break
+        else:
+            self.chunks = None
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.base += self.pos
+        self.pos = 0
+        self.end = len(self.buf)
+        return True
 
     def token(self):
         """ Return the next token (a Token object) found in the
@@ -89,27 +519,60 @@ class Lexer(object):
             buffer matches no rule), a LexerError is raised with
             the position of the error.
         """
-        if self.pos >= len(self.buf):
-            return None
-        else:
-            if self.skip_whitespace:
-                m = self.re_ws_skip.search(self.buf[self.pos:])
+        while True:
+            pos = self.pos
+            if pos >= self.end:
+                if self.refill():
+                    continue
+                return None
 
-                if m:
-                    self.pos += m.start()
-                else:
+            # match at the current offset instead of slicing the
+            # rest of the buffer, which would copy it on every token.
+            # With the index, whitespace is only looked for when the
+            # character there is not known to be something else.
+            if self.skip_whitespace and (self.cur_dispatch is None or
+                    self.buf[pos] not in self.cur_solid):
+                pos = self.cur_ws_skip.match(self.buf, pos).end()
+                if pos >= self.end:
+                    self.pos = pos
+                    if self.refill():
+                        continue
                     return None
 
-            m = self.regex.match(self.buf[self.pos:])
+            buf = self.buf
+            if self.cur_dispatch is not None:
+                char = buf[pos]
+                groupname = self.cur_literals.get(char)
+                if groupname is not None:
+                    # bytes-like buffers give an int; the value is
+                    # bytes, as m.group() returns for any of them
+                    self.pos = pos + 1
+                    return Token(self.group_type[groupname],
+                            char if type(char) is str else bytes((char,)),
+                            self.base + pos, self.group_kind[groupname])
+                regex = self.cur_dispatch.get(char, self.cur_regex)
+            else:
+                regex = self.cur_regex
+            m = regex.match(buf, pos)
+            end = m.end() if m else self.end
+            if end == self.end and self.chunks is not None:
+                # the token (or the error) may continue in the next
+                # chunk of a streamed input, so look again with it
+                self.pos = pos
+                if self.refill():
+                    continue
+
             if m:
                 groupname = m.lastgroup
                 tok_type = self.group_type[groupname]
-                tok = Token(tok_type, m.group(groupname), self.pos)
-                self.pos += m.end()
+                tok = Token(tok_type, m.group(groupname), self.base + pos,
+                        self.group_kind[groupname])
+                self.pos = end
                 return tok
 
             # if we're here, no rule matched
-            raise LexerError(self.pos)
+            self.pos = pos
+            raise LexerError(self.base + pos)
 
     def tokens(self):
         """ Returns an iterator to the tokens found in the buffer.
@@ -119,6 +582,104 @@ class Lexer(object):
             if tok is None: break
             yield tok
 
+    def tokenize(self, buf):
+        """ Tokenize the whole buffer in bulk and return a
+            TokenArray. No Token objects or token values are
+            created; see TokenArray for getting at them.
+            The buffer may be anything input() accepts, and
+            errors are reported with a LexerError as in token().
+        """
+        self.input(buf)
+        tokens = TokenArray(buf, self.kind_names)
+        add_kind = tokens.kinds.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        group_kind = self.group_kind
+
+        pos = 0
+        end = self.end
+        for m in self.cur_bulk_regex.finditer(buf):
+            if m.start() != pos:
+                # finditer skipped something no rule matches
+                break
+            groupname = m.lastgroup
+            start = m.start(groupname)
+            if start >= end:
+                # an empty match at the end is not a token
+                break
+            add_kind(group_kind[groupname])
+            add_start(start)
+            pos = m.end()
+            add_end(pos)
+
+        if self.skip_whitespace:
+            pos = self.cur_ws_skip.match(buf, pos).end()
+        self.pos = pos
+        if pos < self.end:
+            raise LexerError(pos)
+        return tokens
+
+
+class TokenArray(object):
+    """ The tokens of a buffer, stored as three parallel arrays:
+        kinds (the integer kind of each token, see Lexer.kinds),
+        starts and ends (the offsets of each token in the buffer).
+
+        Token values are only sliced out of the buffer when asked
+        for, with text() or token().
+    """
+    def __init__(self, buf, kind_names):
+        self.buf = buf
+        self.kind_names = kind_names
+        self.kinds = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self.token(i)
+
+    def kind(self, type):
+        """ The integer kind of a token type (kinds pass through).
+        """
+        if isinstance(type, int):
+            return type
+        return self.kind_names.index(type)
+
+    def text(self, i):
+        """ The value of the i-th token.
+        """
+        return self.buf[self.starts[i]:self.ends[i]]
+
+    def token(self, i):
+        """ The i-th token as a Token object.
+        """
+        kind = self.kinds[i]
+        return Token(self.kind_names[kind], self.text(i), self.starts[i],
+                kind)
+
+    def count(self, type):
+        """ The number of tokens of the given type (or kind).
+        """
+        return self.kinds.count(self.kind(type))
+
+    def select(self, type):
+        """ A new TokenArray over the same buffer, holding only the
+            tokens of the given type (or kind).
+        """
+        kind = self.kind(type)
+        selected = TokenArray(self.buf, self.kind_names)
+        kinds, starts, ends = self.kinds, self.starts, self.ends
+        for i in range(len(kinds)):
+            if kinds[i] == kind:
+                selected.kinds.append(kind)
+                selected.starts.append(starts[i])
+                selected.ends.append(ends[i])
+        return selected
+
 
 if __name__ == '__main__':
     rules = [
@@ -139,7 +700,7 @@ if __name__ == '__main__':
 
     try:
         for tok in lx.tokens():
-            print tok
-    except LexerError, err:
-        print 'LexerError at position', err.pos
+            print(tok)
+    except LexerError as err:
+        print('LexerError at position', err.pos)
 
@@ -3,26 +3,69 @@
 # This is the generic parser framework. 
 # It initializes the lexer, defines the input string that make up
 import logging
+import mmap
 import sys
 import argparse
 #Please see README on how to get this lexer
 import lexer
+import tracing
+
+class ParseError(Exception):
+    """ Parse error exception.
+
+        pos:
+            Position in the input where the error occurred.
+
+        msg:
+            What was wrong there.
+    """
+    def __init__(self, pos, msg="Parse error"):
+        Exception.__init__(self, "%s at %s" % (msg, pos))
+        self.pos = pos
+        self.msg = msg
+
+    # args holds the formatted message; pickle (e.g. back from a worker
+    # process) the arguments instead
+    def __reduce__(self):
+        return (type(self), (self.pos, self.msg))
+
 
 # Implements a recursive descent parser for thea above grammar(calculator)
 # Since this is LL(1) no backtracking is needed
 # Does not suffer from associativity problems.
 class Parser(object):
 
-    def __init__(self, rules):
+    # the productions (non-terminal methods) of the grammar, which are
+    # wrapped when tracing is on; derived classes list theirs here
+    productions = ("start",)
+
+    # what the lexer skips between tokens (see lexer.Lexer)
+    skip_whitespace = True
+
+    # the profiling.Profiler attached to the instance, if any
+    profiler = None
+
+    def __init__(self, rules, trace=None):
         # initialize the lex rules for the grammar 
-        self.lx = lexer.Lexer(rules, skip_whitespace=True)
+        self.lx = lexer.Lexer(rules, skip_whitespace=self.skip_whitespace)
         self.cur_token = None
         self.next_token = None
+        # bind each token type to its integer kind (e.g. self.NUMBER)
+        # so that match() compares ints rather than type strings
+        for type, kind in self.lx.kinds.items():
+            setattr(self, type, kind)
+        # tracing is bound here, not checked on every token
+        # (None: trace if logging is at INFO or below)
+        self.set_trace(trace)
+
+    #turn tracing of match() and the productions on or off
+    def set_trace(self, enabled=None):
+        return tracing.bind_trace(self, enabled)
 
     #dump token status (including caller info)
     def dts(self, caller=sys._getframe().f_code.co_name):
-        logging.debug("Caller {} \nCurrent token is {} \nNext token is {}".format
-                (caller, self.cur_token, self.next_token));
+        logging.debug("Caller %s \nCurrent token is %s \nNext token is %s",
+                caller, self.cur_token, self.next_token)
 
     #get next token(gnt)
     def gnt(self):
@@ -50,7 +93,7 @@ class Parser(object):
     def gnft(self, token=None):
         if token is None:
             token = self.cur_token
-        if token.type is not "NUMBER":
+        if token.kind != self.lx.kinds.get("NUMBER"):
             logging.critical("Called gnft on a non-number token")
             return None
         return int(token.val)
@@ -64,12 +107,11 @@ class Parser(object):
             return None
         return str(token.val)
 
-    def match(self, type):
-        if (self.next_token and self.next_token.type == type):
-            logging.info("Parsing token {}".format(self.next_token))
+    #match the next token against a token kind (e.g. self.NUMBER)
+    def match(self, kind):
+        if (self.next_token and self.next_token.kind == kind):
             self.uct(self.next_token)
             self.gnt()
-            #self.dts(sys._getframe().f_code.co_name)
             return True
         return False
 
@@ -77,10 +119,18 @@ class Parser(object):
     def start(self):
         raise NotImplementedError()
 
-    #parse the input
+    #hand the input to the lexer: strings and buffers are scanned in
+    #place, file objects and iterators of chunks are streamed
+    def feed(self, input):
+        if isinstance(input, (str, bytes, bytearray, memoryview, mmap.mmap)):
+            self.lx.input(input)
+        else:
+            self.lx.input_stream(input)
+
+    #parse the input (a string, a buffer or a file object)
     def parse(self, input="(5+6)"):
-        logging.info("input is {}".format(input))
-        self.lx.input(input)
+        logging.info("input is %s", input)
+        self.feed(input)
         success, result = self.start()
 
         if success:
@@ -94,10 +144,16 @@ class Parser(object):
 
         arg_parser = argparse.ArgumentParser(description="Parser arguments")
         arg_parser.add_argument('--input', dest='input', action='store', default="5", type=str, help='Specify input to parser')
+        arg_parser.add_argument('--file', dest='file', action='store', default=None, type=str,
+                help='Stream input to parser from a file ("-" for stdin) instead of --input')
+        arg_parser.add_argument('--mmap', help="memory-map --file and parse it in place",
+                action="store_true")
         arg_parser.add_argument("-v", "--verbose", help="increase output verbosity(debug)",
                 action="store_true")
         arg_parser.add_argument("-t", "--trace", help="trace the execution",
                 action="store_true")
+        arg_parser.add_argument('--profile', dest='profile', nargs='?', const='text', default=None,
+                choices=['text', 'json'], help='Profile the parse (tracing off) and report as text or json')
         args = arg_parser.parse_args()
 
         return args
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# Per-production profiling of a parser (Parser subclasses and the CalcParsers).
+# Like tracing, the profiler works by binding wrappers on the parser instance:
+# around each of its `productions` (start, field, expr, term, ...) and around
+# its lexer's token(). Nothing is measured unless a Profiler is attached.
+#
+# Usage:
+#   with profiling.profile(cp) as prof:
+#       cp.parse("5+6")
+#   print(prof.format_table())
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """ Call counts, inclusive/exclusive time per production, tokens
+        per type and lexer vs parser time of one parser.
+    """
+    def __init__(self, parser, clock=time.perf_counter):
+        self.parser = parser
+        self.clock = clock
+        self.saved = None
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.tokens = {}
+        self.lexer_time = 0.0
+        self.total_time = 0.0
+        # time spent in callees, one entry per active production
+        self.child_time = []
+        # active calls per production, so recursion is only counted
+        # once in the inclusive time
+        self.depth = {}
+
+    def reset(self):
+        """ Zero the measurements. The attached wrappers hold on to
+            the containers, so they are cleared in place.
+        """
+        for name in self.calls:
+            self.calls[name] = 0
+            self.inclusive[name] = 0.0
+            self.exclusive[name] = 0.0
+        self.tokens.clear()
+        self.lexer_time = 0.0
+        self.total_time = 0.0
+
+    def attach(self):
+        """ Bind the profiling wrappers. Bind tracing (set_trace) first,
+            as it replaces the productions of the instance.
+        """
+        if self.saved is not None:
+            return self
+        parser = self.parser
+        self.saved = {}
+        for name in parser.productions:
+            self.saved[name] = parser.__dict__.get(name)
+            setattr(parser, name, self._timed_production(name, getattr(parser, name)))
+        self.saved_token = parser.lx.__dict__.get("token")
+        parser.lx.token = self._timed_token(parser.lx.token)
+        # lets the parser skip shortcuts around its productions (e.g. the
+        # fast path of CsvParser.records) so that they are measured
+        parser.profiler = self
+        return self
+
+    def detach(self):
+        """ Unbind the wrappers, restoring whatever was bound before.
+        """
+        if self.saved is None:
+            return
+        parser = self.parser
+        for name, bound in self.saved.items():
+            if bound is None:
+                parser.__dict__.pop(name, None)
+            else:
+                setattr(parser, name, bound)
+        if self.saved_token is None:
+            parser.lx.__dict__.pop("token", None)
+        else:
+            parser.lx.token = self.saved_token
+        parser.__dict__.pop("profiler", None)
+        self.saved = None
+
+    def _timed_production(self, name, production):
+        clock = self.clock
+        calls, inclusive, exclusive = self.calls, self.inclusive, self.exclusive
+        child_time, depth = self.child_time, self.depth
+        calls.setdefault(name, 0)
+        inclusive.setdefault(name, 0.0)
+        exclusive.setdefault(name, 0.0)
+
+        def timed(*args):
+            calls[name] += 1
+            depth[name] = depth.get(name, 0) + 1
+            child_time.append(0.0)
+            t0 = clock()
+            try:
+                return production(*args)
+            finally:
+                elapsed = clock() - t0
+                exclusive[name] += elapsed - child_time.pop()
+                depth[name] -= 1
+                if depth[name] == 0:
+                    inclusive[name] += elapsed
+                if child_time:
+                    child_time[-1] += elapsed
+                else:
+                    self.total_time += elapsed
+        timed.__name__ = name
+        return timed
+
+    def _timed_token(self, token):
+        clock = self.clock
+        tokens = self.tokens
+
+        def timed():
+            t0 = clock()
+            tok = token()
+            self.lexer_time += clock() - t0
+            if tok is not None:
+                tokens[tok.type] = tokens.get(tok.type, 0) + 1
+            return tok
+        return timed
+
+    def report(self):
+        """ The measurements as a dict (times in seconds).
+        """
+        return {
+            "total_time": self.total_time,
+            "lexer_time": self.lexer_time,
+            "parser_time": self.total_time - self.lexer_time,
+            "productions": dict((name, {
+                "calls": self.calls[name],
+                "inclusive": self.inclusive[name],
+                "exclusive": self.exclusive[name],
+            }) for name in self.calls),
+            "tokens": dict(self.tokens),
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2, sort_keys=True)
+
+    def format_table(self):
+        """ The measurements as a text table (times in milliseconds).
+        """
+        report = self.report()
+        lines = ["%-12s %10s %14s %14s" % ("production", "calls", "inclusive ms", "exclusive ms")]
+        for name, stats in report["productions"].items():
+            lines.append("%-12s %10d %14.3f %14.3f" % (name, stats["calls"],
+                    stats["inclusive"] * 1000, stats["exclusive"] * 1000))
+        lines.append("")
+        lines.append("%-12s %10s" % ("token", "count"))
+        for type, count in sorted(report["tokens"].items()):
+            lines.append("%-12s %10d" % (type, count))
+        lines.append("")
+        lines.append("total %.3f ms: lexer %.3f ms, parser %.3f ms" % (
+                report["total_time"] * 1000, report["lexer_time"] * 1000,
+                report["parser_time"] * 1000))
+        return "\n".join(lines)
+
+    def format(self, fmt="text"):
+        """ The report as "text" or "json".
+        """
+        if fmt == "json":
+            return self.to_json()
+        return self.format_table()
+
+
+#profile a parser for the duration of a with block
+@contextmanager
+def profile(parser):
+    profiler = Profiler(parser).attach()
+    try:
+        yield profiler
+    finally:
+        profiler.detach()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# A local parse/evaluate service for the parsers of this repo, so that
+# callers don't pay a Python start and the regex compiles on every call.
+#
+# An asyncio server on a TCP or Unix socket takes one JSON request per line
+# and answers each with one JSON line carrying the same "id":
+#   {"id": 1, "op": "calc", "input": "set x = 2"}
+#       -> {"id": 1, "ok": true, "target": "x", "value": 2}
+#   {"id": 2, "op": "calc", "input": "x*8+y", "vars": {"y": 1}, "grammar": "bnf"}
+#       -> {"id": 2, "ok": true, "value": 17}
+#   {"id": 3, "op": "csv", "input": "a,b\n1,\"2,3\"\n"}
+#       -> {"id": 3, "ok": true, "records": [["a", "b"], ["1", "\"2,3\""]]}
+#   {"id": 4, "op": "stats"}
+#       -> {"id": 4, "ok": true, "stats": {"calc": {"count": 2, "p50_ms": ...}}}
+# A failed request gets "ok": false and an "error" message. The variables of
+# `set` statements are kept per connection ("vars" adds bindings for one
+# request).
+#
+# The parsing runs in a bounded pool of worker processes, each holding its
+# parsers ready (lexer regexes compiled, see warm_worker). A connection's
+# calc requests run one at a time, in the order they were sent, so a
+# statement sees the sets sent before it without waiting for their answers.
+# Everything else runs concurrently (csv and stats requests, and the
+# requests of other connections), so answers may come out of order and
+# clients match them by id. Powers too big to compute are refused (see
+# expr_ast.MAX_POWER_BITS), so no statement keeps a worker forever.
+# At most max_pending requests are in flight over all the connections:
+# past that a connection's next line isn't read until one finishes, and the
+# socket buffers push back on the client.
+# The latencies (from reading a request to writing its answer) of the
+# last LATENCY_WINDOW requests of every op are reported by the stats op and
+# when the server stops.
+#
+# Usage:
+#   python server.py --port 8765
+#   python server.py --unix /tmp/rd_parsers.sock --jobs 4
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import csv_parser
+from expr_batch import GRAMMARS, error_message, worker_parser, worker
+from expr_ast import EvalError
+from expr_session import json_value
+from lexer import LexerError
+from parser import ParseError
+
+# Longest request line accepted
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+# Latencies kept per op for the percentiles
+LATENCY_WINDOW = 10000
+
+# The percentiles reported
+PERCENTILES = (50, 90, 99)
+
+
+#build the parsers of a worker process before its first request; the
+#server stops the workers itself on a ^C
+def warm_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for grammar in GRAMMARS:
+        worker_parser(grammar)
+    csv_worker_parser()
+
+
+#the CSV parser of the current worker
+def csv_worker_parser():
+    cp = getattr(worker, "csv", None)
+    if cp is None:
+        cp = worker.csv = csv_parser.CsvParser(trace=False)
+    return cp
+
+
+#evaluate a statement against vars (runs in a worker); the answer
+def calc_job(text, grammar, vars):
+    if grammar not in GRAMMARS:
+        return {"ok": False, "error": "Unknown grammar %s" % grammar}
+    try:
+        expression = worker_parser(grammar).compile(text)
+        value = expression.evaluate(vars)
+        if expression.target is not None:
+            value = int(value)
+        value = json_value(value)
+    except (ParseError, LexerError, EvalError, ArithmeticError, ValueError, TypeError,
+            RecursionError) as err:
+        return {"ok": False, "error": error_message(err)}
+    answer = {"ok": True, "value": value}
+    if expression.target is not None:
+        answer["target"] = expression.target
+    return answer
+
+
+#parse CSV text (runs in a worker); the answer
+def csv_job(text):
+    try:
+        records = list(csv_worker_parser().records(text))
+    except (ParseError, LexerError, RecursionError) as err:
+        return {"ok": False, "error": error_message(err)}
+    return {"ok": True, "records": records}
+
+
+#the p-th percentile (nearest rank) of sorted values
+def percentile(values, p):
+    rank = max(int(len(values) * p / 100.0 + 0.5), 1)
+    return values[min(rank, len(values)) - 1]
+
+
+class Server(object):
+    """ The service: a process pool and the connections using it.
+
+        max_pending:
+            Most requests in flight at a time (default: 4 per job).
+
+        latencies:
+            The latest latencies (in seconds) of every op.
+
+        stopping:
+            Set to stop serving (done on SIGINT and SIGTERM).
+    """
+    def __init__(self, jobs=None, max_pending=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.jobs
+        self.pool = None
+        self.pending = None
+        self.stopping = None
+        self.latencies = collections.defaultdict(
+                lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """ Start the pool and serve on a Unix socket (path) or on
+            host:port until SIGINT or SIGTERM.
+        """
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.pool = ProcessPoolExecutor(self.jobs, initializer=warm_worker)
+        try:
+            if path is not None:
+                server = await asyncio.start_unix_server(self.handle, path,
+                        limit=MAX_REQUEST_SIZE)
+            else:
+                server = await asyncio.start_server(self.handle, host, port,
+                        limit=MAX_REQUEST_SIZE)
+            async with server:
+                await self.stopping.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            self.pool.shutdown(cancel_futures=True)
+
+    #serve one connection
+    async def handle(self, reader, writer):
+        vars = {}
+        lock = asyncio.Lock()
+        # taken by the calc requests, in the order they are read
+        calc_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.reply(writer, lock, json.dumps({"id": None, "ok": False,
+                            "error": "Request longer than %d bytes" % MAX_REQUEST_SIZE}))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # don't read more from anyone while the pool is full
+                await self.pending.acquire()
+                task = asyncio.ensure_future(self.request(line, vars, calc_lock, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    #answer one request line, and give back its place in the pool
+    async def request(self, line, vars, calc_lock, writer, lock):
+        start = time.perf_counter()
+        op = "error"
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("a request is a JSON object")
+            except ValueError as err:
+                data = json.dumps({"id": None, "ok": False, "error": "Bad request: %s" % err})
+            else:
+                op = request.get("op")
+                answer = {"id": request.get("id")}
+                try:
+                    answer.update(await self.dispatch(op, request, vars, calc_lock))
+                    data = json.dumps(answer)
+                except Exception as err:
+                    # whatever went wrong, the request gets its answer
+                    data = json.dumps({"id": answer["id"], "ok": False,
+                            "error": error_message(err)})
+            try:
+                await self.reply(writer, lock, data)
+            except ConnectionError:
+                # the client is gone
+                pass
+        finally:
+            self.pending.release()
+        self.latencies[op if op in ("calc", "csv", "stats") else "error"].append(
+                time.perf_counter() - start)
+
+    #the answer to a request; the calc requests of a connection take its
+    #calc_lock one after another
+    async def dispatch(self, op, request, vars, calc_lock):
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+        text = request.get("input")
+        if not isinstance(text, str):
+            return {"ok": False, "error": "Missing input"}
+        loop = asyncio.get_running_loop()
+        if op == "csv":
+            return await loop.run_in_executor(self.pool, csv_job, text)
+        if op == "calc":
+            extra = request.get("vars") or {}
+            if not isinstance(extra, dict):
+                return {"ok": False, "error": "vars is not an object"}
+            async with calc_lock:
+                bindings = dict(vars)
+                bindings.update(extra)
+                answer = await loop.run_in_executor(self.pool, calc_job, text,
+                        request.get("grammar", "ebnf"), bindings)
+                if "target" in answer:
+                    vars[answer["target"]] = answer["value"]
+            return answer
+        return {"ok": False, "error": "Unknown op %s" % op}
+
+    #write an answer line
+    async def reply(self, writer, lock, data):
+        async with lock:
+            writer.write(data.encode() + b"\n")
+            await writer.drain()
+
+    def stats(self):
+        """ Count, percentiles and maximum (in milliseconds) of the
+            latencies of every op.
+        """
+        stats = {}
+        for op, latencies in self.latencies.items():
+            values = sorted(latencies)
+            if not values:
+                continue
+            op_stats = {"count": len(values)}
+            for p in PERCENTILES:
+                op_stats["p%d_ms" % p] = round(percentile(values, p) * 1000, 3)
+            op_stats["max_ms"] = round(values[-1] * 1000, 3)
+            stats[op] = op_stats
+        return stats
+
+
+def parse_arguments():
+    """ deal with all the options being passed in"""
+
+    arg_parser = argparse.ArgumentParser(description="Parse/evaluate server arguments")
+    arg_parser.add_argument('--host', dest='host', action='store', default="127.0.0.1", type=str,
+            help='Address to listen on')
+    arg_parser.add_argument('--port', dest='port', action='store', default=8765, type=int,
+            help='TCP port to listen on')
+    arg_parser.add_argument('--unix', dest='unix', action='store', default=None, type=str,
+            help='Listen on this Unix socket path instead of TCP')
+    arg_parser.add_argument('--jobs', dest='jobs', action='store', default=None, type=int,
+            help='Number of worker processes (default: number of CPUs)')
+    arg_parser.add_argument('--max-pending', dest='max_pending', action='store', default=None,
+            type=int, help='Most requests in flight (default: 4 per job)')
+    return arg_parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    server = Server(args.jobs, args.max_pending)
+    asyncio.run(server.serve(args.host, args.port, args.unix))
+    print(json.dumps(server.stats()), file=sys.stderr)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Tests of the LRU cache and of its users: the compile caches of the
+# calculator parsers and the lexer's registry of compiled rules.
+#
+# Run with: python -m pytest test_cache.py (or python -m unittest)
+import os
+import tempfile
+import threading
+import unittest
+
+import expr_bnf_parser
+import expr_ebnf_parser
+import lexer
+from cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # a is now the most recently used, so b goes
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.values(), [1, 3])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "evictions": 1,
+                "size": 2, "maxsize": 2})
+
+    def test_replace(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # replacing an entry makes it the most recent and evicts nothing
+        cache.put('a', 10)
+        cache.put('c', 3)
+        self.assertEqual(cache.values(), [10, 3])
+        self.assertEqual(cache.stats()["evictions"], 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_maxsize(self):
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+    def test_threads(self):
+        cache = LRUCache(16)
+
+        def work(n):
+            for i in range(2000):
+                key = (n * 7 + i) % 40
+                if cache.get(key) is None:
+                    cache.put(key, key)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], 8000)
+        self.assertEqual(stats["size"], 16)
+        self.assertTrue(all(cache.get(key) == key for key in list(cache.entries)))
+
+
+class CompileCacheTest(unittest.TestCase):
+    """ The compile cache of both CalcParsers.
+    """
+    modules = (expr_bnf_parser, expr_ebnf_parser)
+
+    def test_counters(self):
+        for module in self.modules:
+            cp = module.CalcParser(module.RULES, trace=False, cache_size=2)
+            first = cp.compile('x*2')
+            self.assertIs(cp.compile('x*2'), first)
+            cp.compile('x+1')
+            cp.compile('x+2')
+            # x*2 was the least recently used
+            self.assertIsNot(cp.compile('x*2'), first)
+            self.assertEqual(cp.compile_cache.stats(), {"hits": 1, "misses": 4,
+                    "evictions": 2, "size": 2, "maxsize": 2}, module.__name__)
+
+    def test_set(self):
+        for module in self.modules:
+            cp = module.CalcParser(module.RULES, trace=False, cache_size=4)
+            for value in (3, 5, 3):
+                cp.compile('set x = %d' % value).execute(cp.vars)
+                # the cached tree reads the latest value of x
+                self.assertEqual(cp.compile('x*2').execute(cp.vars), 2 * value,
+                        module.__name__)
+            self.assertEqual(cp.compile_cache.stats()["hits"], 3, module.__name__)
+
+    def test_off(self):
+        for module in self.modules:
+            cp = module.CalcParser(module.RULES, trace=False, cache_size=0)
+            self.assertIsNone(cp.compile_cache)
+            self.assertIsNot(cp.compile('x*2'), cp.compile('x*2'))
+
+
+class TablesRegistryTest(unittest.TestCase):
+    """ The registry of compiled lexer rules.
+    """
+    def test_shared(self):
+        rules = expr_ebnf_parser.RULES
+        tables = lexer.compile_rules(rules)
+        hits = lexer.tables_cache.hits
+        self.assertIs(lexer.compile_rules([list(rule) for rule in rules]), tables)
+        self.assertEqual(lexer.tables_cache.hits, hits + 1)
+        self.assertIsNot(lexer.compile_rules(rules, skip_whitespace=False), tables)
+
+    def test_save_load(self):
+        rules = [('[0-9]+', 'NUMBER'), ('[a-z]+', 'WORD')]
+        lexer.compile_rules(rules)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            lexer.save_tables(path)
+            lexer.tables_cache.clear()
+            self.assertGreater(lexer.load_tables(path), 0)
+        finally:
+            os.remove(path)
+        lx = lexer.Lexer(rules)
+        lx.input('ab 12')
+        self.assertEqual([(tok.type, tok.val) for tok in lx.tokens()],
+                [('WORD', 'ab'), ('NUMBER', '12')])
+
+
+if __name__ == '__main__':
+    unittest.main()
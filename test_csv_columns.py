@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Tests of the columnar CSV output and its type inference.
+#
+# Run with: python -m pytest test_csv_columns.py (or python -m unittest)
+import math
+import unittest
+
+import csv_columns
+
+
+#the inferred type and the values of a column of strings
+def inferred(values):
+    column = csv_columns.StringColumn()
+    for value in values:
+        column.append(value)
+    type, column = csv_columns.infer(column)
+    return type, list(column)
+
+
+class InferTest(unittest.TestCase):
+
+    def test_int(self):
+        self.assertEqual(inferred(['1', '-22', '+3', '0']), ('int', [1, -22, 3, 0]))
+        self.assertEqual(inferred([str(2 ** 63)]), ('float', [2.0 ** 63]))
+
+    def test_float(self):
+        type, values = inferred(['1.5', '', '-2', '.5e-3', '7.', '1E3'])
+        self.assertEqual(type, 'float')
+        self.assertTrue(math.isnan(values[1]))
+        self.assertEqual(values[:1] + values[2:], [1.5, -2.0, 0.0005, 7.0, 1000.0])
+
+    def test_empty(self):
+        self.assertEqual(inferred(['', '']), ('str', ['', '']))
+        self.assertEqual(inferred([]), ('str', []))
+
+    def test_str(self):
+        for value in ('abc', ' 12', '12 ', '1_000', 'inf', '-Infinity', 'nan', '0x10',
+                '1e', '.', '+', '١'):
+            self.assertEqual(inferred(['1', value]), ('str', ['1', value]), value)
+            self.assertEqual(inferred(['1.5', value]), ('str', ['1.5', value]), value)
+
+    def test_columns(self):
+        text = 'name,count,price\na,1,1.5\nb,2\nc,x,3,é\n'
+        cols = csv_columns.parse_columns(text, header=True)
+        self.assertEqual(cols.names, ['name', 'count', 'price', '3'])
+        self.assertEqual(cols.types, ['str', 'str', 'float', 'str'])
+        self.assertEqual(len(cols), 3)
+        self.assertEqual(list(cols['name']), ['a', 'b', 'c'])
+        self.assertEqual(list(cols['count']), ['1', '2', 'x'])
+        price = list(cols['price'])
+        self.assertEqual((price[0], price[2]), (1.5, 3.0))
+        self.assertTrue(math.isnan(price[1]))
+        # ragged rows are padded with empty values
+        self.assertEqual(list(cols[3]), ['', '', 'é'])
+
+    def test_no_header(self):
+        cols = csv_columns.parse_columns('1,2\n3\n')
+        self.assertIsNone(cols.names)
+        self.assertEqual(cols.types, ['int', 'float'])
+        self.assertEqual(list(cols[0]), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
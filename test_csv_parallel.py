@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Tests of the parallel CSV parser against parsing the whole file with one
+# CsvParser.
+#
+# Run with: python -m pytest test_csv_parallel.py (or python -m unittest)
+import logging
+import os
+import pickle
+import tempfile
+import unittest
+
+import csv_parallel
+import csv_parser
+from parser import ParseError
+
+
+def setUpModule():
+    # the CSV parser logs badly nested quotes
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+class ParallelTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    #the records of the file parsed in parallel, or the ParseError
+    def parallel(self, chunk_size, ordered=True):
+        try:
+            return list(csv_parallel.parse_parallel(self.path, jobs=2, ordered=ordered,
+                    chunk_size=chunk_size))
+        except ParseError as err:
+            return err
+
+    def test_records(self):
+        data = 'a,b\n"c,\nd",e\né,"f"\n,\n'.encode('utf-8') * 20
+        self.write(data)
+        expected = list(csv_parser.CsvParser(trace=False).records(data.decode('utf-8')))
+        for chunk_size in (1, 5, 64, 1 << 20):
+            self.assertEqual(self.parallel(chunk_size), expected, chunk_size)
+            self.assertEqual(sorted(self.parallel(chunk_size, ordered=False)),
+                    sorted(expected), chunk_size)
+
+    def test_error_position(self):
+        for data in (b'a,b\nc,d\ne,f\n"x"y,z\n', 'é,b\ncé,d\n"x"y\n'.encode('utf-8')):
+            self.write(data)
+            # the byte offset of the error, as when parsing the bytes
+            with self.assertRaises(ParseError) as expected:
+                list(csv_parser.CsvParser(trace=False).records(data))
+            for chunk_size in (2, 1 << 20):
+                err = self.parallel(chunk_size)
+                self.assertIsInstance(err, ParseError)
+                self.assertEqual((err.pos, err.msg, str(err)), (expected.exception.pos,
+                        expected.exception.msg, str(expected.exception)))
+
+    def test_pickle(self):
+        err = pickle.loads(pickle.dumps(ParseError(15, "Unexpected STRING")))
+        self.assertEqual((err.pos, err.msg, str(err)), (15, "Unexpected STRING",
+                "Unexpected STRING at 15"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+# Differential tests: every pair of engines that should give the same
+# results is run side by side over random inputs.
+#
+# Run with: python -m pytest test_equivalence.py (or python -m unittest)
+import io
+import json
+import logging
+import math
+import random
+import unittest
+
+import csv_parser
+import expr_batch
+import expr_codegen
+import expr_ebnf_parser
+import expr_iterative_parser
+import expr_optimize
+import expr_session
+import lexer
+from lexer import LexerError
+from parser import ParseError
+
+# Bindings the random expressions are evaluated against
+BINDINGS = [{'x': 2, 'y': -3}, {'x': 0, 'y': 1}]
+
+LEAVES = ['x', 'y', '0', '1', '2', '3']
+
+# Pieces of random inputs for the lexer and the CSV parser; # and the
+# accented letter start no rule
+EXPR_PIECES = ['x', 'y1', '42', '+', '-', '*', '/', '^', '(', ')', '=', 'set', ' ', '\t',
+        '#', '\u00e9']
+CSV_PIECES = ['a', 'b', ' ', '\t', ',', '\n', '"', '\r', '\u00e9', 'x y']
+
+
+def setUpModule():
+    # the CSV parser logs badly nested quotes
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+
+
+#a random expression of the EBNF grammar about depth levels deep; the
+#exponents of ^ are leaves, so that the values stay small
+def random_expr(rnd, depth):
+    if depth == 0 or rnd.random() < 0.3:
+        return rnd.choice(LEAVES)
+    if rnd.random() < 0.2:
+        return '(%s)' % random_expr(rnd, depth - 1)
+    if rnd.random() < 0.25:
+        return '(%s) ^ %s' % (random_expr(rnd, depth - 1), rnd.choice(LEAVES))
+    return '%s %s %s' % (random_expr(rnd, depth - 1), rnd.choice('+-*/'),
+            random_expr(rnd, depth - 1))
+
+
+#what calling fn gives: its value (with its type) or the type of its error
+def outcome(fn):
+    try:
+        value = fn()
+    except Exception as err:
+        return type(err).__name__
+    if isinstance(value, complex):
+        value = (value.real, value.imag)
+        if any(math.isnan(v) for v in value):
+            return 'nan'
+        return (complex, value)
+    if isinstance(value, float) and math.isnan(value):
+        return 'nan'
+    return (type(value), value)
+
+
+#the input as str and as every kind of bytes-like buffer
+def buffers(text):
+    data = text.encode('utf-8')
+    return [text, data, bytearray(data), memoryview(data)]
+
+
+#the (type, value, value type, position) of every token of data, and the
+#position of the error that stops it
+def lex(rules, data, dispatch, **options):
+    lx = lexer.Lexer(rules, dispatch=dispatch, **options)
+    lx.input(data)
+    tokens = []
+    try:
+        for tok in lx.tokens():
+            tokens.append((tok.type, tok.val, type(tok.val), tok.pos))
+    except LexerError as err:
+        tokens.append(('error', err.pos))
+    return tokens
+
+
+#the records of input (their fields as lists of str), and the position
+#of the error that stops them
+def csv_records(input, fast):
+    records = []
+    try:
+        for record in csv_parser.CsvParser(trace=False).records(input, fast=fast):
+            records.append(list(record))
+    except ParseError as err:
+        records.append(('error', err.pos))
+    return records
+
+
+def ebnf_parser(**options):
+    return expr_ebnf_parser.CalcParser(expr_ebnf_parser.RULES, trace=False,
+            cache_size=0, **options)
+
+
+class CodegenTest(unittest.TestCase):
+    """ Generated code (optimized or not) against tree walking.
+    """
+    def check(self, optimize, count=10000, seed=0):
+        cp = ebnf_parser()
+        rnd = random.Random(seed)
+        for i in range(count):
+            text = random_expr(rnd, 3)
+            expression = cp.compile(text)
+            compiled = expression
+            if optimize:
+                compiled = expr_optimize.optimize(compiled)
+            compiled = expr_codegen.generate(compiled)
+            for bindings in BINDINGS:
+                self.assertEqual(outcome(lambda: expression.evaluate(bindings)),
+                        outcome(lambda: compiled.evaluate(bindings)), text)
+
+    def test_codegen(self):
+        self.check(optimize=False)
+
+    def test_optimize_codegen(self):
+        self.check(optimize=True)
+
+    def test_negative_constant_power(self):
+        cp = ebnf_parser(optimize=True, codegen=True)
+        self.assertEqual(cp.compile("(1-4)^x").evaluate({'x': 2}), 9)
+
+    def test_power_bound(self):
+        for options in ({}, {'optimize': True}, {'codegen': True},
+                {'optimize': True, 'codegen': True}):
+            cp = ebnf_parser(**options)
+            self.assertEqual(outcome(lambda: cp.compile("2^3^4^5").evaluate({})),
+                    'OverflowError', options)
+            self.assertEqual(outcome(lambda: cp.compile("x^3^4^5").evaluate({'x': 2})),
+                    'OverflowError', options)
+            self.assertEqual(cp.compile("x^3^4").evaluate({'x': 2}), 2 ** 81, options)
+
+
+class LexerDispatchTest(unittest.TestCase):
+    """ The first-character index against the plain combined regex,
+        on str and bytes-like buffers.
+    """
+    def check(self, rules, pieces, **options):
+        rnd = random.Random(0)
+        for i in range(2000):
+            text = ''.join(rnd.choice(pieces) for j in range(rnd.randint(0, 12)))
+            for data in buffers(text):
+                self.assertEqual(lex(rules, data, False, **options),
+                        lex(rules, data, True, **options), repr(data))
+
+    def test_expr_rules(self):
+        self.check(expr_ebnf_parser.RULES, EXPR_PIECES)
+
+    def test_csv_rules(self):
+        self.check(csv_parser.RULES, CSV_PIECES,
+                skip_whitespace=csv_parser.CsvParser.skip_whitespace)
+
+
+class CsvFastPathTest(unittest.TestCase):
+    """ The quote-free fast path of CsvParser.records() against the
+        productions, on whole, streamed and bytes-like inputs.
+    """
+    def test_fast_path(self):
+        rnd = random.Random(0)
+        for i in range(2000):
+            text = ''.join(rnd.choice(CSV_PIECES) for j in range(rnd.randint(0, 30)))
+            expected = csv_records(text, False)
+            self.assertEqual(csv_records(text, True), expected, repr(text))
+            self.assertEqual(csv_records(io.StringIO(text), True), expected, repr(text))
+            for size in (1, 3, 7):
+                chunks = [text[j:j + size] for j in range(0, len(text), size)]
+                self.assertEqual(csv_records(chunks, True), expected, repr(text))
+
+            data = text.encode('utf-8')
+            expected = csv_records(data, False)
+            for buffer in buffers(text)[1:]:
+                self.assertEqual(csv_records(buffer, True), expected, repr(buffer))
+                self.assertEqual(csv_records(buffer, False), expected, repr(buffer))
+
+
+class OptimizeTest(unittest.TestCase):
+    """ Optimized trees against the plain ones.
+    """
+    def test_optimize(self):
+        cp = ebnf_parser()
+        rnd = random.Random(1)
+        for i in range(10000):
+            text = random_expr(rnd, 3)
+            expression = cp.compile(text)
+            optimized = expr_optimize.optimize(expression)
+            for bindings in BINDINGS:
+                self.assertEqual(outcome(lambda: expression.evaluate(bindings)),
+                        outcome(lambda: optimized.evaluate(bindings)), text)
+
+
+class IterativeParserTest(unittest.TestCase):
+    """ The iterative engine against the recursive EBNF parser: the
+        same trees, errors and values.
+    """
+    def compiled(self, cp, text):
+        try:
+            expression = cp.compile(text)
+        except (ParseError, LexerError) as err:
+            return type(err).__name__, str(err), None
+        return repr(expression.tree), expression.target, expression
+
+    def check(self, text):
+        recursive = self.compiled(ebnf_parser(), text)
+        iterative = self.compiled(expr_iterative_parser.CalcParser(
+                expr_iterative_parser.RULES, trace=False, cache_size=0), text)
+        self.assertEqual(recursive[:2], iterative[:2], text)
+        if recursive[2] is not None:
+            for bindings in BINDINGS:
+                self.assertEqual(outcome(lambda: recursive[2].evaluate(bindings)),
+                        outcome(lambda: iterative[2].evaluate(bindings)), text)
+
+    def test_expressions(self):
+        rnd = random.Random(2)
+        for i in range(3000):
+            text = random_expr(rnd, 3)
+            if rnd.random() < 0.2:
+                text = 'set z = ' + text
+            self.check(text)
+
+    def test_malformed(self):
+        rnd = random.Random(3)
+        for i in range(3000):
+            self.check(''.join(rnd.choice(EXPR_PIECES[:-2]) for j in range(rnd.randint(0, 10))))
+
+    def test_optimized(self):
+        recursive = ebnf_parser(optimize=True)
+        iterative = expr_iterative_parser.CalcParser(expr_iterative_parser.RULES,
+                trace=False, cache_size=0, optimize=True)
+        rnd = random.Random(6)
+        for i in range(3000):
+            text = random_expr(rnd, 3)
+            # repeated subexpressions become Shared nodes
+            text = '(%s) * (%s) - %s' % (text, text, text)
+            expression = iterative.compile(text)
+            self.assertIsInstance(expression, expr_iterative_parser.IterativeOptimizedExpression)
+            for bindings in BINDINGS:
+                self.assertEqual(outcome(lambda: recursive.compile(text).evaluate(bindings)),
+                        outcome(lambda: expression.evaluate(bindings)), text)
+        expression = expr_optimize.optimize(iterative.compile('(x+1)*(x+1) - 3'))
+        self.assertEqual(expression.evaluate({'x': 2}), 6)
+        self.assertEqual(expr_iterative_parser.evaluate_tree(expression.tree,
+                expr_optimize.Scope({'x': 2})), 6)
+
+    def test_deep(self):
+        cp = expr_iterative_parser.CalcParser(expr_iterative_parser.RULES, trace=False)
+        depth = 10000
+        self.assertEqual(cp.compile('(' * depth + 'x' + ' + 1)' * depth).evaluate({'x': 1}),
+                depth + 1)
+        self.assertEqual(cp.compile(' ^ '.join(['1'] * depth)).evaluate({}), 1)
+
+
+class BatchTest(unittest.TestCase):
+    """ Batch evaluation against running the statements one after
+        another through one parser.
+    """
+    def sequential(self, statements):
+        cp = ebnf_parser()
+        vars = {}
+        results = []
+        for text in statements:
+            try:
+                results.append((cp.compile(text).execute(vars), None))
+            except Exception as err:
+                results.append((None, expr_batch.error_message(err)))
+        return results
+
+    def test_batch(self):
+        rnd = random.Random(4)
+        statements = []
+        for i in range(500):
+            if rnd.random() < 0.2:
+                statements.append('set x = %d' % rnd.randint(-3, 3))
+            else:
+                statements.append(random_expr(rnd, 3))
+        # unknown identifiers, parse errors and nesting too deep for the
+        # recursive parser are reported per statement
+        statements[10:10] = ['q + 1', '(1', 'x #', '(' * 3000 + '1' + ')' * 3000]
+        results = [(result.value, result.error) for result in
+                expr_batch.evaluate_batch(statements, jobs=2, threads=True, chunk_size=7)]
+        self.assertEqual(len(results), len(statements))
+        for text, result, expected in zip(statements, results, self.sequential(statements)):
+            # the wording of a RecursionError depends on where it hit,
+            # so errors are compared by their type
+            if result[1] is not None or expected[1] is not None:
+                result, expected = (result[1] or '').split(':')[0], (expected[1] or '').split(':')[0]
+            self.assertEqual(outcome(lambda: result), outcome(lambda: expected), text[:80])
+
+
+class SessionTest(unittest.TestCase):
+    """ Script mode against batch evaluation: every statement gets a
+        JSON record with the same value or error.
+    """
+    def test_session(self):
+        rnd = random.Random(5)
+        statements = ['set x = 2', '(0-2)^(1/2)', '2^20000', '(' * 3000 + '1' + ')' * 3000]
+        statements += [random_expr(rnd, 3) for i in range(200)]
+        records = list(expr_session.run_session(statements))
+        self.assertEqual(len(records), len(statements))
+        batch = expr_batch.evaluate_batch(statements, jobs=1, threads=True)
+        for record, result in zip(records, batch):
+            text = record["input"][:80]
+            json.dumps(record)
+            if "value" in record:
+                self.assertTrue(result.ok, text)
+                self.assertEqual(outcome(lambda: expr_session.json_value(result.value)),
+                        outcome(lambda: record["value"]), text)
+            elif result.ok:
+                # a value too long to write out as JSON
+                self.assertTrue(record["error"].startswith("ValueError"), text)
+            else:
+                self.assertEqual(result.error.split(':')[0],
+                        record["error"].split(':')[0], text)
+
+
+if __name__ == '__main__':
+    unittest.main()
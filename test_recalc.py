@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# Tests of the incremental recalculation of set formulas, also against
+# evaluating every formula again after each change.
+#
+# Run with: python -m pytest test_recalc.py (or python -m unittest)
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import expr_iterative_parser
+import expr_recalc
+from expr_ast import Expression
+from expr_recalc import CycleError, RecalcSession
+
+
+class RecalcTest(unittest.TestCase):
+
+    def test_readme(self):
+        s = RecalcSession()
+        self.assertEqual(s.execute("set total = price * count"), ['total'])
+        self.assertIn('total', s.errors)
+        self.assertEqual(s.execute("set price = 7"), ['price', 'total'])
+        self.assertEqual(s.update({"count": 3}), ['total'])
+        self.assertEqual(s.vars["total"], 21)
+        self.assertEqual(s.errors, {})
+        self.assertEqual(s.execute("total + 1"), 22)
+
+    def test_order(self):
+        s = RecalcSession()
+        s.update({"x": 1})
+        s.execute("set c = a + b")
+        s.execute("set a = x * 2")
+        s.execute("set b = a + x")
+        # c uses a and b, b uses a: each after the ones it uses
+        self.assertEqual(s.update({"x": 2}), ['a', 'b', 'c'])
+        self.assertEqual((s.vars["a"], s.vars["b"], s.vars["c"]), (4, 6, 10))
+
+    def test_cycle(self):
+        s = RecalcSession()
+        s.execute("set b = a + 1")
+        s.execute("set c = b * 2")
+        with self.assertRaises(CycleError) as raised:
+            s.execute("set a = c - 1")
+        self.assertEqual(raised.exception.cycle, ['a', 'b', 'c', 'a'])
+        with self.assertRaises(CycleError) as raised:
+            s.execute("set d = d + 1")
+        self.assertEqual(raised.exception.cycle, ['d', 'd'])
+        # a refused formula changes nothing
+        self.assertNotIn('a', s.formulas)
+        self.assertEqual(s.update({"a": 1}), ['b', 'c'])
+        self.assertEqual(s.vars["c"], 4)
+
+    def test_unchanged(self):
+        s = RecalcSession()
+        s.update({"x": 3, "y": 1})
+        s.execute("set sign = x / x")
+        s.execute("set big = sign * 1000")
+        s.execute("set other = y + 1")
+        # sign keeps its value, so big is not evaluated again
+        self.assertEqual(s.update({"x": 5}), ['sign'])
+        # nor is anything for an input set to its current value
+        self.assertEqual(s.update({"y": 1}), [])
+        self.assertEqual(s.update({"y": 2}), ['other'])
+
+    def test_remove(self):
+        s = RecalcSession()
+        s.execute("set a = 2")
+        s.execute("set b = a * 10")
+        self.assertEqual(s.remove("a"), ['b'])
+        self.assertNotIn('a', s.vars)
+        self.assertNotIn('b', s.vars)
+        self.assertTrue(s.errors['b'].startswith('EvalError'))
+        self.assertEqual(s.remove("a"), [])
+        self.assertEqual(s.execute("set a = 3"), ['a', 'b'])
+        self.assertEqual(s.vars["b"], 30)
+        self.assertEqual(s.errors, {})
+        # a formula replaced by an input stops depending on anything
+        s.update({"b": 1})
+        self.assertEqual(s.execute("set a = 4"), ['a'])
+        self.assertEqual(s.vars["b"], 1)
+
+    def test_errors(self):
+        s = RecalcSession()
+        s.execute("set b = 1 / a")
+        s.update({"a": 0})
+        self.assertTrue(s.errors['b'].startswith('ZeroDivisionError'))
+        s.update({"a": 2})
+        self.assertEqual(s.vars["b"], 0)
+        self.assertEqual(s.errors, {})
+
+    def test_against_full(self):
+        rnd = random.Random(0)
+        names = ['a', 'b', 'c', 'd', 'e']
+        s = RecalcSession()
+        inputs = {}
+        formulas = {}
+        for i in range(500):
+            name = rnd.choice(names)
+            if rnd.random() < 0.4:
+                inputs[name] = rnd.randint(-3, 3)
+                formulas.pop(name, None)
+                s.update({name: inputs[name]})
+            else:
+                used = rnd.sample(names, 2)
+                text = "set %s = %s %s %s" % (name, used[0], rnd.choice('+-*'), used[1])
+                try:
+                    s.execute(text)
+                except CycleError:
+                    continue
+                formulas[name] = s.formulas[name]
+                inputs.pop(name, None)
+            self.assertEqual(s.vars, full(inputs, formulas), i)
+
+
+#the values of the formulas evaluated from scratch, each once its
+#identifiers have values (the dependencies have no cycles)
+def full(inputs, formulas):
+    values = dict(inputs)
+    left = dict(formulas)
+    progress = True
+    while progress:
+        progress = False
+        for name, expression in list(left.items()):
+            if all(used in values or used not in left for used in expression.names):
+                del left[name]
+                progress = True
+                try:
+                    values[name] = int(expression.evaluate(values))
+                except Exception:
+                    pass
+    return values
+
+
+class DeepTest(unittest.TestCase):
+    """ Formulas nested too deep to evaluate recursively fail on their
+        own.
+    """
+    def test_recalculate(self):
+        # parsed without recursion, evaluated with
+        cp = expr_iterative_parser.CalcParser(expr_iterative_parser.RULES, trace=False)
+        tree = cp.compile("set a = x" + " ^ 1" * 3000).tree
+        s = RecalcSession(cp)
+        s.update({"x": 1})
+        self.assertEqual(s.define(Expression(tree, 'a')), ['a'])
+        self.assertTrue(s.errors['a'].startswith('RecursionError'))
+        self.assertEqual(s.update({"x": 2}), ['a'])
+        self.assertEqual(s.execute("set b = x * 2"), ['b'])
+        self.assertEqual(s.vars["b"], 4)
+
+    def test_cli(self):
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as f:
+            f.write("set a = %s1%s\nset b = 2\nb * 3\n" % ("(" * 3000, ")" * 3000))
+        try:
+            run = subprocess.run([sys.executable, expr_recalc.__file__, '--file', path],
+                    capture_output=True, text=True)
+        finally:
+            os.remove(path)
+        self.assertEqual(run.returncode, 1)
+        self.assertEqual(run.stderr, '')
+        self.assertEqual(run.stdout.splitlines(), ['1: error: RecursionError: maximum '
+                'recursion depth exceeded', '2: b = 2', '3: 6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
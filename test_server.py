@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# Tests of the parse/evaluate server, over a Unix socket in a temporary
+# directory.
+#
+# Run with: python -m pytest test_server.py (or python -m unittest)
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import server
+
+
+class GatedServer(server.Server):
+    """ A server whose requests wait for gate before running, and
+        which counts the requests in flight.
+    """
+    def __init__(self, jobs=None, max_pending=None):
+        server.Server.__init__(self, jobs, max_pending)
+        self.gate = None
+        self.active = 0
+        self.most_active = 0
+
+    async def dispatch(self, op, request, vars, calc_lock):
+        self.active += 1
+        self.most_active = max(self.most_active, self.active)
+        try:
+            await self.gate.wait()
+            return await server.Server.dispatch(self, op, request, vars, calc_lock)
+        finally:
+            self.active -= 1
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'server.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    #run test(server) against srv serving on the socket
+    def run_server(self, srv, test):
+        async def main():
+            serving = asyncio.ensure_future(srv.serve(path=self.path))
+            while not os.path.exists(self.path):
+                await asyncio.sleep(0.01)
+            try:
+                await asyncio.wait_for(test(), 60)
+            finally:
+                srv.stopping.set()
+                await serving
+        asyncio.run(main())
+
+    async def connect(self):
+        return await asyncio.open_unix_connection(self.path)
+
+    #send requests (without waiting for answers) and read as many
+    #answers, by id
+    async def exchange(self, requests, connection=None):
+        reader, writer = connection or await self.connect()
+        writer.write(b"".join(json.dumps(r).encode() + b"\n" for r in requests))
+        await writer.drain()
+        answers = {}
+        for i in range(len(requests)):
+            answer = json.loads(await reader.readline())
+            answers[answer["id"]] = answer
+        if connection is None:
+            writer.close()
+        return answers
+
+    def test_pipelined(self):
+        async def test():
+            statements = ["set z = 5", "z+1", "set z = z*2", "z", "set w = z+1", "w*z"]
+            answers = await self.exchange([{"id": i, "op": "calc", "input": text}
+                    for i, text in enumerate(statements)])
+            self.assertEqual([answers[i]["value"] for i in range(len(statements))],
+                    [5, 6, 10, 10, 11, 110])
+            self.assertEqual(answers[4]["target"], "w")
+            # the variables are the connection's own
+            answers = await self.exchange([{"id": 1, "op": "calc", "input": "z"}])
+            self.assertEqual(answers[1]["error"], "EvalError: Identifier z not set")
+        self.run_server(server.Server(jobs=2), test)
+
+    def test_errors(self):
+        async def test():
+            requests = [
+                {"id": 1, "op": "calc", "input": "2^3^4^5"},
+                {"id": 2, "op": "calc", "input": "(0-2)^(1/2)"},
+                {"id": 3, "op": "calc", "input": "(" * 3000 + "1" + ")" * 3000},
+                {"id": 4, "op": "calc", "input": "1+", "grammar": "bnf"},
+                {"id": 5, "op": "calc", "input": "1", "grammar": "lisp"},
+                {"id": 6, "op": "csv", "input": "a,\"b\"c\n"},
+                {"id": 7, "op": "nope", "input": ""},
+                {"id": 8, "op": "calc"},
+                {"id": 9, "op": "calc", "input": "x*2", "vars": {"x": 4}},
+            ]
+            answers = await self.exchange(requests)
+            self.assertTrue(answers[1]["error"].startswith("OverflowError"))
+            self.assertEqual(answers[2]["value"], repr((-2) ** 0.5))
+            self.assertTrue(answers[3]["error"].startswith("RecursionError"))
+            self.assertTrue(answers[4]["error"].startswith("ParseError"))
+            self.assertEqual(answers[5]["error"], "Unknown grammar lisp")
+            self.assertTrue(answers[6]["error"].startswith("ParseError"))
+            self.assertEqual(answers[7]["error"], "Unknown op nope")
+            self.assertEqual(answers[8]["error"], "Missing input")
+            self.assertEqual(answers[9]["value"], 8)
+            self.assertFalse(any(answers[i]["ok"] for i in range(1, 9) if i != 2))
+
+            reader, writer = await self.connect()
+            writer.write(b"[1]\nnot json\n")
+            for i in range(2):
+                answer = json.loads(await reader.readline())
+                self.assertIsNone(answer["id"])
+                self.assertTrue(answer["error"].startswith("Bad request"))
+            writer.close()
+        self.run_server(server.Server(jobs=1), test)
+
+    def test_backpressure(self):
+        srv = GatedServer(jobs=1, max_pending=2)
+
+        async def test():
+            srv.gate = asyncio.Event()
+            first = await self.connect()
+            second = await self.connect()
+            requests = [{"id": i, "op": "calc", "input": "%d*2" % i} for i in range(6)]
+            exchanges = [asyncio.ensure_future(self.exchange(requests[:3], first)),
+                    asyncio.ensure_future(self.exchange(requests[3:], second))]
+            await asyncio.sleep(0.2)
+            # no more requests are read while max_pending are in flight
+            self.assertEqual(srv.active, 2)
+            srv.gate.set()
+            first, second = await asyncio.gather(*exchanges)
+            self.assertEqual(srv.most_active, 2)
+            for i in range(6):
+                self.assertEqual((first if i < 3 else second)[i]["value"], 2 * i)
+        self.run_server(srv, test)
+
+    def test_stats(self):
+        async def test():
+            await self.exchange([{"id": 1, "op": "calc", "input": "1+1"},
+                    {"id": 2, "op": "calc", "input": "1+"},
+                    {"id": 3, "op": "csv", "input": "a,b\n"},
+                    {"id": 4, "op": "what"}])
+            stats = (await self.exchange([{"id": 5, "op": "stats"}]))[5]["stats"]
+            self.assertEqual(stats["calc"]["count"], 2)
+            self.assertEqual(stats["csv"]["count"], 1)
+            self.assertEqual(stats["error"]["count"], 1)
+            for op_stats in stats.values():
+                self.assertEqual(sorted(op_stats), ["count", "max_ms", "p50_ms",
+                        "p90_ms", "p99_ms"])
+                self.assertTrue(0 <= op_stats["p50_ms"] <= op_stats["p90_ms"] <=
+                        op_stats["p99_ms"] <= op_stats["max_ms"])
+            # the stats request itself is counted once it is answered
+            stats = (await self.exchange([{"id": 6, "op": "stats"}]))[6]["stats"]
+            self.assertEqual(stats["stats"]["count"], 1)
+        self.run_server(server.Server(jobs=1), test)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([server.percentile(values, p) for p in (50, 90, 99, 100)],
+                [50, 90, 99, 100])
+        self.assertEqual(server.percentile([7], 50), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Tracing for the parsers (Parser subclasses and the CalcParsers).
+# Tracing is bound when a parser is constructed (or by its set_trace()):
+# match() and the productions listed in the parser's `productions` are
+# wrapped by functions that log the token status. With tracing off the
+# wrappers are removed again, so the parser runs its plain methods and
+# pays nothing for the debugging support.
+import logging
+
+
+#should a parser trace when it is not told either way?
+def trace_default():
+    return logging.getLogger().isEnabledFor(logging.INFO)
+
+
+#wrap a production so that it dumps the token status when called
+def traced_production(parser, name, production):
+    def traced(*args):
+        parser.dts(name)
+        result = production(*args)
+        logging.debug("%s result is %s", name, result)
+        return result
+    traced.__name__ = name
+    return traced
+
+
+#wrap match() so that it logs every token it consumes
+def traced_match(parser, match):
+    def traced(kind):
+        token = parser.next_token
+        if match(kind):
+            logging.info("Parsing token %s", token, stacklevel=2)
+            parser.dts("match")
+            return True
+        return False
+    traced.__name__ = "match"
+    return traced
+
+
+#bind (or unbind) the tracing wrappers on a parser instance
+def bind_trace(parser, enabled=None):
+    if enabled is None:
+        enabled = trace_default()
+
+    # instance attributes shadow the class methods; dropping them
+    # unbinds any wrappers from an earlier call
+    for name in ("match",) + tuple(parser.productions):
+        parser.__dict__.pop(name, None)
+
+    if enabled:
+        for name in parser.productions:
+            setattr(parser, name, traced_production(parser, name, getattr(parser, name)))
+        parser.match = traced_match(parser, parser.match)
+
+    parser.tracing = enabled
+    return enabled